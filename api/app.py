@@ -1,16 +1,25 @@
 """
 FastAPI后端服务
 """
+import os
+import time
 import asyncio
+import tempfile
+from contextlib import asynccontextmanager
 from typing import Dict, Any, Optional
+import anyio.to_thread
+import orjson
 from fastapi import FastAPI, HTTPException, WebSocket
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from pathlib import Path
 import sys
 import logging
 
 # 添加项目根目录到路径
-sys.path.insert(0, str(Path(__file__).parent.parent))
+ROOT_DIR = str(Path(__file__).parent.parent)
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
 
 from src.config import config
 from src.logger import setup_logger, get_logger
@@ -22,16 +31,125 @@ from src.bot import Bot
 # 日志
 logger = get_logger(__name__)
 
+# 线程池上限（anyio默认40）
+# 注意：所有接口都应保持 async def；同步的 def 接口会被放进线程池执行，
+# 并发较高时容易耗尽线程池、拖住整个服务。这里调大上限只作为兜底。
+THREADPOOL_SIZE = 200
+
+# 多worker模式下，只有抢到该锁文件的worker负责运行Bot（其余worker只提供API）
+BOT_LOCK_FILE = Path(tempfile.gettempdir()) / "clauqbot-api-bot.lock"
+
+
+def claim_bot_owner() -> bool:
+    """
+    判断当前worker是否负责运行Bot
+
+    单worker时总是返回True；多worker时（由CLAUQBOT_API_WORKERS环境变量告知）
+    第一个成功创建锁文件的worker成为Bot所有者。锁文件中记录所有者PID，
+    所有者进程已退出（如崩溃后worker被重新拉起）时由当前worker接管。
+
+    Returns:
+        True: 当前worker负责运行Bot
+        False: 其他worker已负责运行Bot
+    """
+    if int(os.environ.get('CLAUQBOT_API_WORKERS', '1')) <= 1:
+        return True
+
+    try:
+        fd = os.open(str(BOT_LOCK_FILE), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        if bot_owner_alive():
+            return False
+        # 锁文件由已退出的进程遗留，清理后重新争抢
+        logger.warning("Bot锁文件的所有者进程已退出，重新争抢Bot所有权")
+        BOT_LOCK_FILE.unlink(missing_ok=True)
+        try:
+            fd = os.open(str(BOT_LOCK_FILE), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+    os.write(fd, str(os.getpid()).encode())
+    os.close(fd)
+    return True
+
+
+def bot_owner_alive() -> bool:
+    """
+    检查锁文件中记录的Bot所有者进程是否仍在运行
+
+    锁文件刚创建、尚未写入PID时按仍在运行处理。
+    """
+    try:
+        pid = int(BOT_LOCK_FILE.read_text().strip())
+    except FileNotFoundError:
+        return False
+    except ValueError:
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # 进程存在但无权发送信号
+    return True
+
+
+class ORJSONResponse(JSONResponse):
+    """使用orjson序列化的JSON响应"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def not_owner_response() -> ORJSONResponse:
+    """
+    非Bot所有者worker拒绝修改配置和控制Bot的请求
+
+    多worker时各worker的配置互不同步，只有运行Bot的worker上的修改才会生效。
+    """
+    return ORJSONResponse(
+        status_code=409,
+        content={"status": "error", "message": "当前worker不负责运行Bot，无法修改配置或控制Bot"}
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时启动Bot，关闭时停止Bot"""
+    global bot_owner
+
+    logger.info("FastAPI 服务启动中...")
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+    bot_owner = claim_bot_owner()
+    if bot_owner:
+        await start_bot()
+    else:
+        logger.info("其他worker已负责运行Bot，当前worker仅提供API")
+
+    yield
+
+    logger.info("FastAPI 服务关闭中...")
+    if bot_owner:
+        await stop_bot()
+        BOT_LOCK_FILE.unlink(missing_ok=True)
+
+
 # FastAPI应用
 app = FastAPI(
     title="ClauQBot API",
     description="ClauQBot 后端API",
-    version="0.2.0"
+    version="0.2.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # 全局变量
 bot_client: Optional[Bot] = None
 bot_task: Optional[asyncio.Task] = None
+bot_owner: bool = True
+bot_network_config: Optional[Dict[str, Any]] = None  # 当前连接使用的网络配置
 
 
 class ConfigModel(BaseModel):
@@ -46,28 +164,6 @@ class ConfigModel(BaseModel):
     api: Optional[Dict[str, Any]] = None
 
 
-@app.on_event("startup")
-async def startup():
-    """启动事件"""
-    global bot_client, bot_task
-
-    logger.info("FastAPI 服务启动中...")
-
-    # 启动Bot
-    await start_bot()
-
-
-@app.on_event("shutdown")
-async def shutdown():
-    """关闭事件"""
-    global bot_client, bot_task
-
-    logger.info("FastAPI 服务关闭中...")
-
-    # 停止Bot
-    await stop_bot()
-
-
 @app.get("/")
 async def root():
     """根路径"""
@@ -85,7 +181,8 @@ async def get_status():
     """
     return {
         "bot_running": bot_client is not None,
-        "bot_task_running": bot_task is not None and not bot_task.done()
+        "bot_task_running": bot_task is not None and not bot_task.done(),
+        "bot_owner": bot_owner
     }
 
 
@@ -94,27 +191,42 @@ async def get_detailed_status():
     """
     获取详细的服务状态（包含心跳和连接信息）
     """
+    if not bot_owner:
+        return {
+            "bot_running": False,
+            "bot_owner": False,
+            "message": "当前worker不负责运行Bot"
+        }
+
     if bot_client is None:
         return {
             "bot_running": False,
+            "bot_owner": True,
             "message": "Bot未运行"
         }
 
-    # 获取Bot详细状态
-    bot_status = bot_client.get_status()
-
-    # 获取Claude重试统计
-    claude_stats = bot_client.claude.get_retry_stats()
-
     return {
         "bot_running": True,
-        "bot_status": bot_status,
-        "claude_handler": claude_stats,
+        "bot_owner": True,
+        "bot_status": bot_client.get_status(),
+        "claude_handler": bot_client.claude.get_retry_stats(),
         "onebot": {
             "connected": bot_client.client.is_connected(),
             "last_heartbeat": bot_client.client.get_last_heartbeat_time()
         },
-        "timestamp": asyncio.get_event_loop().time()
+        "timestamp": time.monotonic()
+    }
+
+
+@app.get("/dashboard")
+async def get_dashboard():
+    """
+    获取系统状态页所需的全部数据（详细状态、服务信息、配置），一次请求返回
+    """
+    return {
+        "status": await get_detailed_status(),
+        "root": await root(),
+        "config": config.to_dict()
     }
 
 
@@ -127,54 +239,151 @@ async def get_config():
 @app.post("/config")
 async def update_config(config_data: ConfigModel):
     """更新配置"""
-    config_dict = config_data.dict(exclude_unset=True)
+    if not bot_owner:
+        return not_owner_response()
+
+    config_dict = config_data.model_dump(exclude_unset=True)
     for key, value in config_dict.items():
         config.set(key, value)
     return {"status": "success", "message": "配置已更新"}
 
 
+@app.patch("/config")
+async def patch_config(config_data: ConfigModel):
+    """部分更新配置（只合并提交的项，未提交的项保持不变）"""
+    if not bot_owner:
+        return not_owner_response()
+
+    config_dict = config_data.model_dump(exclude_unset=True)
+    for key, value in config_dict.items():
+        current = config.get(key)
+        if isinstance(current, dict) and isinstance(value, dict):
+            value = merge_config(current, value)
+        config.set(key, value)
+    return {"status": "success", "message": "配置已更新"}
+
+
+def merge_config(base: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    递归合并配置
+
+    Args:
+        base: 原配置（不会被修改）
+        patch: 需要更新的项
+
+    Returns:
+        合并后的新配置
+    """
+    merged = dict(base)
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def create_bot(onebot_client: OneBotClient, config_dict: Dict[str, Any]) -> Bot:
+    """
+    基于已有的OneBot客户端创建Claude处理器和Bot
+
+    Args:
+        onebot_client: OneBot客户端
+        config_dict: 配置快照
+
+    Returns:
+        Bot实例
+    """
+    claude_config = config_dict.get('claude', {})
+
+    # 创建Claude处理器（带重试）
+    claude_handler = ClaudeHandler(
+        cli_path=claude_config.get('cli_path', 'claude'),
+        work_dir=claude_config.get('work_dir', '.'),
+        timeout=claude_config.get('timeout', 300),
+        max_retries=claude_config.get('max_retries', 3),
+        initial_backoff=claude_config.get('initial_backoff', 1.0),
+        max_backoff=claude_config.get('max_backoff', 60.0),
+        max_concurrent=claude_config.get('max_concurrent', 4),
+        logger=logger
+    )
+
+    # 创建Bot
+    return Bot(
+        onebot_client=onebot_client,
+        claude_handler=claude_handler,
+        config=config_dict,
+        logger=logger
+    )
+
+
+async def connect_and_listen(onebot_client: OneBotClient):
+    """
+    连接OneBot（失败时按退避策略重试）并开始监听消息
+
+    超过最大重试次数仍无法连接或发生意外错误时停止Bot，状态接口不再报告Bot运行中。
+    """
+    try:
+        await onebot_client.connect()
+        await onebot_client.listen()
+    except ConnectionError as e:
+        logger.error(f"OneBot连接失败，Bot已停止: {e}")
+        await clear_bot(onebot_client)
+    except Exception as e:
+        logger.error(f"OneBot连接异常，Bot已停止: {e}", exc_info=True)
+        await clear_bot(onebot_client)
+
+
+async def clear_bot(onebot_client: OneBotClient):
+    """连接任务异常结束时停止心跳和worker并清除Bot状态（Bot已换用其他连接时不处理）"""
+    global bot_client, bot_task, bot_network_config
+
+    if bot_client is None or bot_client.client is not onebot_client:
+        return
+    await bot_client.stop_heartbeat()
+    await bot_client.stop_worker()
+    bot_client = None
+    bot_task = None
+    bot_network_config = None
+
+
 @app.post("/bot/start")
 async def start_bot():
     """启动Bot"""
-    global bot_client, bot_task
+    global bot_client, bot_task, bot_network_config
+
+    if not bot_owner:
+        return not_owner_response()
 
     if bot_client is not None:
         return {"status": "error", "message": "Bot已在运行"}
 
     try:
+        # 配置快照（只取一次）
+        config_dict = config.to_dict()
+        network_config = config_dict.get('network', {})
+
         # 创建OneBot客户端
         onebot_client = OneBotClient(
-            ws_url=config.get('network.onebot_ws_url'),
-            on_message=lambda data: asyncio.create_task(bot_client.on_message(data)),
+            ws_url=network_config.get('onebot_ws_url'),
+            on_message=lambda data: bot_client.enqueue_message(data),
             logger=logger,
-            reconnect_interval=config.get('network.reconnect_interval', 5),
-            timeout=config.get('network.timeout', 30)
-        )
-
-        # 创建Claude处理器（带重试）
-        claude_handler = ClaudeHandler(
-            cli_path=config.get('claude.cli_path', 'claude'),
-            work_dir=config.get('claude.work_dir', '.'),
-            timeout=config.get('claude.timeout', 300),
-            max_retries=config.get('claude.max_retries', 3),
-            initial_backoff=config.get('claude.initial_backoff', 1.0),
-            max_backoff=config.get('claude.max_backoff', 60.0),
-            logger=logger
+            reconnect_interval=network_config.get('reconnect_interval', 5),
+            timeout=network_config.get('timeout', 30),
+            send_rate=network_config.get('send_rate', 2.0),
+            send_burst=network_config.get('send_burst', 3),
+            max_retries=network_config.get('reconnect_max_retries', 0)
         )
 
         # 创建Bot
-        bot_client = Bot(
-            onebot_client=onebot_client,
-            claude_handler=claude_handler,
-            config=config.to_dict(),
-            logger=logger
-        )
+        bot_client = create_bot(onebot_client, config_dict)
+        bot_network_config = dict(network_config)
 
-        # 连接OneBot
-        await onebot_client.connect()
+        # 启动消息处理worker
+        await bot_client.start_worker()
 
-        # 启动监听任务
-        bot_task = asyncio.create_task(onebot_client.listen())
+        # 连接OneBot并监听（在后台进行，OneBot暂不可用时不阻塞API启动）
+        bot_task = asyncio.create_task(connect_and_listen(onebot_client))
 
         # 启动心跳检测
         await bot_client.start_heartbeat()
@@ -192,6 +401,9 @@ async def stop_bot():
     """停止Bot"""
     global bot_client, bot_task
 
+    if not bot_owner:
+        return not_owner_response()
+
     if bot_client is None:
         return {"status": "error", "message": "Bot未运行"}
 
@@ -199,6 +411,7 @@ async def stop_bot():
         # 停止心跳检测
         if bot_client:
             await bot_client.stop_heartbeat()
+            await bot_client.stop_worker()
 
         # 断开OneBot连接
         await bot_client.client.disconnect()
@@ -224,10 +437,36 @@ async def stop_bot():
 
 @app.post("/bot/restart")
 async def restart_bot():
-    """重启Bot"""
+    """重启Bot（连接正常且网络配置未变化时复用现有OneBot连接）"""
+    global bot_client
+
+    if not bot_owner:
+        return not_owner_response()
+
+    config_dict = config.to_dict()
+    connection_alive = (
+        bot_client is not None
+        and bot_task is not None
+        and not bot_task.done()
+        and bot_client.client.is_connected()
+    )
+    if connection_alive and config_dict.get('network', {}) == bot_network_config:
+        # 只重建Claude处理器和Bot，不断开OneBot连接
+        await bot_client.stop_heartbeat()
+        await bot_client.stop_worker()
+
+        bot_client = create_bot(bot_client.client, config_dict)
+        await bot_client.start_worker()
+        await bot_client.start_heartbeat()
+
+        logger.info("Bot已重启（复用OneBot连接）")
+        return {"status": "success", "message": "Bot已重启"}
+
+    # 连接已断开或网络配置变化，完整重启（disconnect会等待连接关闭完成）
     await stop_bot()
-    await asyncio.sleep(1)
-    await start_bot()
+    result = await start_bot()
+    if result.get('status') != 'success':
+        return result
     return {"status": "success", "message": "Bot已重启"}
 
 
@@ -247,11 +486,18 @@ if __name__ == "__main__":
         backup_count=config.get('logging.file.backup_count', 5)
     )
 
-    # 启动服务
+    # 启动服务（多worker时不能启用reload；事件循环和HTTP解析器由uvicorn自动选择，
+    # 已安装uvloop/httptools时优先使用）
     api_config = config.get('api', {})
+    workers = api_config.get('workers', 1)
+    if workers > 1:
+        os.environ['CLAUQBOT_API_WORKERS'] = str(workers)
+        BOT_LOCK_FILE.unlink(missing_ok=True)  # 清理上次异常退出遗留的锁
+
     uvicorn.run(
         "api.app:app",
         host=api_config.get('host', '127.0.0.1'),
         port=api_config.get('port', 8000),
-        reload=True
+        workers=workers,
+        reload=workers <= 1
     )
@@ -2,9 +2,10 @@
 Bot核心逻辑模块
 """
 import re
+import time
 import asyncio
 import inspect
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable, Awaitable
 import logging
 from .onebot_client import OneBotClient
 from .claude_handler import ClaudeHandler
@@ -13,6 +14,11 @@ from .claude_handler import ClaudeHandler
 class Bot:
     """Bot核心逻辑"""
 
+    # 去重记录的最大消息数（超出时淘汰最早的记录）
+    SEEN_MAX = 4096
+    # 去重记录的保留时间（秒），过期记录在心跳循环中清理
+    SEEN_TTL = 600
+
     def __init__(
         self,
         onebot_client: OneBotClient,
@@ -39,10 +45,26 @@ class Bot:
         self.qq_number = bot_config.get('qq_number', '')
         self.auto_reply_private = bot_config.get('auto_reply_private', True)
         self.ignore_temp_session = bot_config.get('ignore_temp_session', True)
+        self.stream_reply = bot_config.get('stream_reply', False)
         self.command_prefixes = bot_config.get('command_prefix', ['/c', '/claude', '/问', '/ask'])
 
+        # 预编译命令前缀匹配（长前缀优先，避免 /claude 被 /c 截断）
+        self._prefix_tuple = tuple(self.command_prefixes)
+        self._prefix_re = re.compile("|".join(
+            map(re.escape, sorted(self.command_prefixes, key=len, reverse=True))
+        )) if self.command_prefixes else None
+
+        # 消息类型 -> 处理函数（新增消息类型时在此注册）
+        self.message_handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]] = {
+            'private': self.handle_private_message,
+            'group': self.handle_group_message,
+        }
+
         # 消息队列（用于处理并发）
-        self.processing_messages: set = set()
+        self.seen_messages: Dict[int, float] = {}  # 已处理的message_id -> 到达时间（按插入顺序，防重复处理）
+        self.inbox: asyncio.Queue = asyncio.Queue(maxsize=bot_config.get('message_queue_size', 1024))
+        self.worker_count = bot_config.get('message_workers', 4)  # 并发处理消息的worker数
+        self.worker_tasks: List[asyncio.Task] = []
 
         # 心跳检测
         self.heartbeat_task: Optional[asyncio.Task] = None
@@ -52,12 +74,70 @@ class Bot:
         self.heartbeat_interval = bot_config.get('heartbeat_interval', 60)  # 秒
         self.heartbeat_enabled = bot_config.get('heartbeat_enabled', True)
 
-        # 状态回调（用于WebUI更新）
-        self.status_callbacks = []
+        # 状态回调（用于WebUI更新，dict保持注册顺序并去重）
+        self.status_callbacks: Dict[Any, None] = {}
+
+        # 后台发送任务（保持引用，避免任务被提前回收）
+        self.background_tasks: set = set()
 
     def add_status_callback(self, callback):
-        """添加状态变化回调"""
-        self.status_callbacks.append(callback)
+        """添加状态变化回调（重复注册同一回调只生效一次）"""
+        self.status_callbacks[callback] = None
+
+    def _run_in_background(self, coro) -> asyncio.Task:
+        """在后台执行协程，不阻塞当前流程"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self._on_background_done)
+        return task
+
+    def _on_background_done(self, task: asyncio.Task):
+        """后台任务结束回调"""
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            self.logger.warning(f"后台发送失败: {task.exception()}")
+
+    async def start_worker(self):
+        """启动消息处理worker（固定数量，Claude调用的并发再由ClaudeHandler限制）"""
+        if self.worker_tasks:
+            return
+        self.worker_tasks = [
+            asyncio.create_task(self._consume()) for _ in range(max(1, self.worker_count))
+        ]
+
+    async def stop_worker(self):
+        """停止消息处理worker"""
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+
+    async def enqueue_message(self, data: Dict[str, Any]):
+        """
+        将OneBot消息事件放入队列（作为OneBotClient的消息回调）
+
+        Args:
+            data: OneBot消息数据
+        """
+        # 心跳、元事件等非消息帧不进入队列
+        if data.get('post_type') != 'message':
+            return
+
+        try:
+            self.inbox.put_nowait(data)
+        except asyncio.QueueFull:
+            self.logger.warning(f"消息队列已满（{self.inbox.maxsize}），丢弃消息")
+
+    async def _consume(self):
+        """从队列中取出消息并处理"""
+        while True:
+            data = await self.inbox.get()
+            try:
+                await self.on_message(data)
+            except Exception as e:
+                self.logger.error(f"处理消息失败: {e}", exc_info=True)
+            finally:
+                self.inbox.task_done()
 
     async def start_heartbeat(self):
         """启动心跳检测"""
@@ -91,14 +171,16 @@ class Bot:
 
                 if not is_connected:
                     self._handle_disconnect("NapCat连接已断开")
-                    continue
+                else:
+                    # 发送心跳测试
+                    await self._test_connection()
 
-                # 发送心跳测试
-                await self._test_connection()
+                    # 如果之前失败过，现在恢复正常
+                    if self.connection_failures > 0:
+                        self._handle_reconnect()
 
-                # 如果之前失败过，现在恢复正常
-                if self.connection_failures > 0:
-                    self._handle_reconnect()
+                # 每个心跳周期清理过期去重记录
+                self._sweep_seen_messages()
 
             except asyncio.CancelledError:
                 break
@@ -106,15 +188,28 @@ class Bot:
                 self.logger.error(f"心跳检测异常: {e}", exc_info=True)
                 self._handle_disconnect(f"心跳异常: {e}")
 
+    def _sweep_seen_messages(self):
+        """清理过期的去重记录（按到达顺序存储，从最早的开始删除即可）"""
+        expire_before = time.monotonic() - self.SEEN_TTL
+        seen = self.seen_messages
+        while seen:
+            oldest = next(iter(seen))
+            if seen[oldest] >= expire_before:
+                break
+            del seen[oldest]
+
     async def _test_connection(self):
         """测试连接"""
         try:
             # 使用WebSocket ping作为心跳测试，而不是API调用
             # 这更安全，不依赖特定的API
-            if self.client.websocket and not self.client.websocket.closed:
-                # 发送WebSocket ping
-                await self.client.websocket.ping()
-                self.last_heartbeat_time = asyncio.get_event_loop().time()
+            if self.client.is_connected():
+                # 心跳间隔内收到过数据说明连接活跃，无需再发送ping
+                now = time.monotonic()
+                last_received = self.client.last_received_time
+                if last_received is None or now - last_received > self.heartbeat_interval:
+                    await self.client.websocket.ping()
+                self.last_heartbeat_time = now
 
                 # 连接成功，重置失败计数
                 if self.connection_failures > 0:
@@ -151,7 +246,7 @@ class Bot:
         status = {
             "online": self.online_status,
             "connection_failures": self.connection_failures,
-            "timestamp": asyncio.get_event_loop().time()
+            "timestamp": time.monotonic()
         }
 
         # 调用所有回调
@@ -172,7 +267,7 @@ class Bot:
             "connection_failures": self.connection_failures,
             "heartbeat_interval": self.heartbeat_interval,
             "client_connected": self.client.is_connected(),
-            "message_count": len(self.processing_messages),
+            "message_count": self.inbox.qsize(),
             "heartbeat_enabled": self.heartbeat_enabled
         }
 
@@ -188,26 +283,25 @@ class Bot:
             return
 
         message_type = data.get('message_type')
-        user_id = data.get('user_id')
-        group_id = data.get('group_id')
-        sub_type = data.get('sub_type', '')
 
-        # 生成消息唯一ID（防重复处理）
-        message_id = f"{message_type}_{user_id}_{group_id or 'private'}"
-        if message_id in self.processing_messages:
-            self.logger.debug(f"消息已在处理中，跳过: {message_id}")
+        # 按OneBot的message_id去重（防重复处理）
+        message_id = data.get('message_id')
+        if message_id is not None:
+            if message_id in self.seen_messages:
+                self.logger.debug("消息已处理，跳过: %s", message_id)
+                return
+            self.seen_messages[message_id] = time.monotonic()
+            if len(self.seen_messages) > self.SEEN_MAX:
+                del self.seen_messages[next(iter(self.seen_messages))]
+
+        handler = self.message_handlers.get(message_type)
+        if handler is None:
             return
-        self.processing_messages.add(message_id)
 
         try:
-            if message_type == 'private':
-                await self.handle_private_message(data)
-            elif message_type == 'group':
-                await self.handle_group_message(data)
+            await handler(data)
         except Exception as e:
             self.logger.error(f"处理消息失败: {e}", exc_info=True)
-        finally:
-            self.processing_messages.discard(message_id)
 
     async def handle_private_message(self, data: Dict[str, Any]):
         """处理私聊消息"""
@@ -215,11 +309,11 @@ class Bot:
         sub_type = data.get('sub_type', '')
         message = self.extract_message_text(data.get('message', []))
 
-        self.logger.info(f"[私聊] 用户 {user_id}: {message[:50]}...")
+        self.logger.info("[私聊] 用户 %s: %.50s...", user_id, message)
 
         # 忽略临时会话
         if self.ignore_temp_session and sub_type != 'friend':
-            self.logger.debug(f"忽略临时会话: {user_id}")
+            self.logger.debug("忽略临时会话: %s", user_id)
             return
 
         # 检查是否是命令
@@ -243,10 +337,10 @@ class Bot:
         is_mentioned = data.get('to_me', False)
 
         if not is_mentioned:
-            self.logger.debug(f"[群聊 {group_id}] 未@机器人，忽略")
+            self.logger.debug("[群聊 %s] 未@机器人，忽略", group_id)
             return
 
-        self.logger.info(f"[群聊 {group_id}] 用户 {user_id} @Bot: {message[:50]}...")
+        self.logger.info("[群聊 %s] 用户 %s @Bot: %.50s...", group_id, user_id, message)
 
         # 空消息检查
         if not message.strip():
@@ -270,7 +364,7 @@ class Bot:
             await self.send_error(data, "请输入问题，例如：/c 解释一下这段代码")
             return
 
-        self.logger.info(f"[命令] {actual_message[:50]}...")
+        self.logger.info("[命令] %.50s...", actual_message)
 
         message_type = data.get('message_type')
         if message_type == 'private':
@@ -282,62 +376,78 @@ class Bot:
 
     async def reply_to_user(self, user_id: int, message: str):
         """回复私聊用户"""
-        # 发送"正在思考"提示
-        await self.client.send_private_message(user_id, "Claude 正在思考...")
+        await self._reply(self.client.send_private_message, user_id, message)
 
-        # 调用Claude
-        result = await self.claude.call(message)
-
-        if result['success']:
-            answer = result['result']
+    async def reply_to_group(self, group_id: int, message: str):
+        """回复群聊"""
+        await self._reply(self.client.send_group_message, group_id, message)
 
-            # 添加成本信息
-            cost = result.get('cost_usd', 0)
-            if cost > 0:
-                answer += f"\n\n[成本] ${cost:.4f}"
+    async def _reply(self, send_method, target_id: int, message: str):
+        """
+        调用Claude并回复（私聊和群聊共用）
 
-            # 分段发送（QQ消息长度限制）
-            await self.send_long_message(
-                lambda msg: self.client.send_private_message(user_id, msg),
-                answer
-            )
-        else:
-            error = result.get('error', '未知错误')
-            await self.client.send_private_message(user_id, f"[错误] {error}")
+        Args:
+            send_method: 发送方法（如 client.send_private_message）
+            target_id: 用户ID或群ID
+            message: 用户消息
+        """
+        # 发送"正在思考"提示（后台发送，不等待，让Claude调用尽早开始）
+        thinking_task = self._run_in_background(send_method(target_id, "Claude 正在思考..."))
 
-    async def reply_to_group(self, group_id: int, message: str):
-        """回复群聊"""
-        # 发送"正在思考"提示
-        await self.client.send_group_message(group_id, "Claude 正在思考...")
+        async def on_text(text: str):
+            """流式回复：Claude每产生一段文本就立即发送"""
+            await asyncio.wait([thinking_task])
+            await self.send_long_message(send_method, target_id, text)
 
         # 调用Claude
-        result = await self.claude.call(message)
+        result = await self.claude.call(message, on_text=on_text if self.stream_reply else None)
 
-        if result['success']:
-            answer = result['result']
+        # 确保提示先于回复送达
+        await asyncio.wait([thinking_task])
 
-            # 添加成本信息
+        if result['success']:
+            # 成本信息（作为后缀附加到最后一段，避免复制整段回复）
             cost = result.get('cost_usd', 0)
-            if cost > 0:
-                answer += f"\n\n[成本] ${cost:.4f}"
-
-            # 分段发送
-            await self.send_long_message(
-                lambda msg: self.client.send_group_message(group_id, msg),
-                answer
-            )
+            suffix = f"\n\n[成本] ${cost:.4f}" if cost > 0 else ""
+
+            if result.get('streamed'):
+                # 回复已流式发出，只补发成本信息
+                if suffix:
+                    await send_method(target_id, suffix.strip())
+                return
+
+            # 分段发送（QQ消息长度限制）
+            await self.send_long_message(send_method, target_id, result['result'], suffix=suffix)
         else:
             error = result.get('error', '未知错误')
-            await self.client.send_group_message(group_id, f"[错误] {error}")
+            await send_method(target_id, f"[错误] {error}")
 
-    async def send_long_message(self, send_func, message: str, max_length: int = 2000):
-        """发送长消息（自动分段）"""
-        if len(message) <= max_length:
-            await send_func(message)
-        else:
-            for i in range(0, len(message), max_length):
-                await send_func(message[i:i+max_length])
-                await asyncio.sleep(0.5)  # 避免触发频率限制
+    async def send_long_message(
+        self,
+        send_method,
+        target_id: int,
+        message: str,
+        max_length: int = 2000,
+        suffix: str = ""
+    ):
+        """
+        发送长消息（自动分段，保证分段顺序；发送频率由OneBotClient限速）
+
+        Args:
+            send_method: 发送方法（如 client.send_private_message）
+            target_id: 用户ID或群ID
+            message: 消息内容
+            max_length: 单条消息最大长度
+            suffix: 附加在最后一段的后缀（放不下时单独发送）
+        """
+        chunks = [message[i:i+max_length] for i in range(0, len(message), max_length)] or [message]
+        if suffix:
+            if len(chunks[-1]) + len(suffix) <= max_length:
+                chunks[-1] += suffix
+            else:
+                chunks.append(suffix)
+        for chunk in chunks:
+            await send_method(target_id, chunk)
 
     async def send_error(self, data: Dict[str, Any], error_msg: str):
         """发送错误消息"""
@@ -351,22 +461,17 @@ class Bot:
 
     def extract_message_text(self, message_data: List[Dict[str, Any]]) -> str:
         """从消息数据中提取纯文本"""
-        text = ""
-        for segment in message_data:
-            if segment.get('type') == 'text':
-                text += segment.get('data', {}).get('text', '')
-        return text.strip()
+        return "".join([
+            segment.get('data', {}).get('text', '')
+            for segment in message_data
+            if segment.get('type') == 'text'
+        ]).strip()
 
     def is_command(self, message: str) -> bool:
         """检查是否是命令"""
-        for prefix in self.command_prefixes:
-            if message.startswith(prefix):
-                return True
-        return False
+        return message.startswith(self._prefix_tuple)
 
     def strip_command_prefix(self, message: str) -> str:
         """去掉命令前缀"""
-        for prefix in self.command_prefixes:
-            if message.startswith(prefix):
-                return message[len(prefix):].strip()
-        return message
+        match = self._prefix_re.match(message) if self._prefix_re else None
+        return message[match.end():].strip() if match else message
@@ -1,14 +1,19 @@
 """
 Claude调用处理模块
 """
+import re
 import subprocess
 import asyncio
-import json
 import os
 import time
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable, Awaitable
 import logging
+import orjson
+
+
+# 流式输出时单行JSON事件的最大长度（长回复的单条事件可能很大）
+STREAM_LINE_LIMIT = 2 ** 24
 
 
 class ClaudeHandler:
@@ -25,6 +30,7 @@ class ClaudeHandler:
         "502",
         "504"
     ]
+    _RETRYABLE_RE = re.compile("|".join(map(re.escape, RETRYABLE_ERRORS)), re.IGNORECASE)
 
     def __init__(
         self,
@@ -34,6 +40,7 @@ class ClaudeHandler:
         max_retries: int = 3,
         initial_backoff: float = 1.0,
         max_backoff: float = 60.0,
+        max_concurrent: int = 4,
         logger: Optional[logging.Logger] = None
     ):
         """
@@ -46,16 +53,25 @@ class ClaudeHandler:
             max_retries: 最大重试次数
             initial_backoff: 初始退避时间（秒）
             max_backoff: 最大退避时间（秒）
+            max_concurrent: 同时运行的Claude CLI进程数上限
             logger: 日志器
         """
         self.cli_path = cli_path
         self.work_dir = Path(work_dir).resolve()
+        self._work_dir_str = str(self.work_dir)  # subprocess使用的cwd（预先转换）
         self.timeout = timeout
         self.max_retries = max_retries
         self.initial_backoff = initial_backoff
         self.max_backoff = max_backoff
+        self.max_concurrent = max_concurrent
         self.logger = logger or logging.getLogger(__name__)
 
+        # 限制并发的CLI进程数（超出的调用排队等待）
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+        # 已解析的Claude CLI路径（首次调用时查找并缓存）
+        self._cached_cli_path: Optional[str] = None
+
         # 确保工作目录存在
         self.work_dir.mkdir(parents=True, exist_ok=True)
 
@@ -96,8 +112,7 @@ class ClaudeHandler:
             True: 可重试
             False: 不可重试
         """
-        error_lower = error_message.lower()
-        return any(keyword in error_lower for keyword in self.RETRYABLE_ERRORS)
+        return self._RETRYABLE_RE.search(error_message) is not None
 
     def _calculate_backoff(self, attempt: int) -> float:
         """
@@ -112,12 +127,18 @@ class ClaudeHandler:
         backoff = self.initial_backoff * (2 ** (attempt - 1))
         return min(backoff, self.max_backoff)
 
-    async def call(self, message: str) -> Dict[str, Any]:
+    async def call(
+        self,
+        message: str,
+        on_text: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> Dict[str, Any]:
         """
         调用Claude CLI（异步，带重试）
 
         Args:
             message: 用户消息
+            on_text: 流式输出回调；提供时使用stream-json格式，
+                     Claude每产生一段文本就立即回调，不必等待全部输出
 
         Returns:
             {
@@ -125,10 +146,13 @@ class ClaudeHandler:
                 "result": str,  # Claude的回复
                 "cost_usd": float,  # API成本（美元）
                 "error": str,  # 错误信息
-                "retries": int  # 重试次数
+                "retries": int,  # 重试次数
+                "streamed": bool  # 回复是否已通过on_text发出（仅流式模式）
             }
         """
-        claude_path = self._find_claude_cli()
+        if self._cached_cli_path is None:
+            self._cached_cli_path = self._find_claude_cli()
+        claude_path = self._cached_cli_path
         if not claude_path:
             return {
                 "success": False,
@@ -142,14 +166,11 @@ class ClaudeHandler:
         last_error = None
         for attempt in range(1, self.max_retries + 1):
             try:
-                # 在线程池中执行同步调用
-                loop = asyncio.get_event_loop()
-                result = await loop.run_in_executor(
-                    None,
-                    self._call_sync,
-                    claude_path,
-                    message
-                )
+                async with self._semaphore:
+                    if on_text is None:
+                        result = await self._call_async(claude_path, message)
+                    else:
+                        result = await self._call_stream(claude_path, message, on_text)
 
                 # 成功则直接返回
                 if result['success']:
@@ -160,9 +181,10 @@ class ClaudeHandler:
                         result['retries'] = 0
                     return result
 
-                # 失败则检查是否可重试
+                # 失败则检查是否可重试（已流式发出部分回复时不重试，避免重复发送）
                 error_message = result.get('error', '')
-                if attempt < self.max_retries and self._is_retryable_error(error_message):
+                if (attempt < self.max_retries and not result.get('streamed')
+                        and self._is_retryable_error(error_message)):
                     last_error = error_message
                     backoff = self._calculate_backoff(attempt)
                     self.logger.warning(
@@ -200,9 +222,22 @@ class ClaudeHandler:
             "retries": self.max_retries
         }
 
-    def _call_sync(self, claude_path: str, message: str) -> Dict[str, Any]:
+    def _build_command(self, claude_path: str, message: str, stream: bool = False) -> List[str]:
+        """构建Claude CLI命令行"""
+        if stream:
+            # stream-json在-p模式下需要同时指定--verbose
+            return [claude_path, "-p", "--output-format", "stream-json", "--verbose", message]
+        return [
+            claude_path,
+            "-p",  # 项目模式
+            "--output-format",
+            "json",
+            message
+        ]
+
+    async def _call_async(self, claude_path: str, message: str) -> Dict[str, Any]:
         """
-        同步调用Claude CLI
+        异步调用Claude CLI（直接在事件循环中等待子进程，不占用线程池）
 
         Args:
             claude_path: Claude CLI路径
@@ -211,63 +246,172 @@ class ClaudeHandler:
         Returns:
             结果字典
         """
-        cmd = [
-            claude_path,
-            "-p",  # 项目模式
-            "--output-format",
-            "json",
-            message
-        ]
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self._build_command(claude_path, message),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=self._work_dir_str
+            )
+        except NotImplementedError:
+            # 事件循环不支持子进程（如Windows上的SelectorEventLoop），退回线程池
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._call_sync, claude_path, message)
+        except FileNotFoundError:
+            # CLI被移除或移动，下次调用时重新查找
+            self._cached_cli_path = None
+            return {
+                "success": False,
+                "error": f"Claude CLI不存在：{claude_path}"
+            }
+
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            await self._kill_process(process)
+            return {
+                "success": False,
+                "error": f"Claude响应超时（超过{self.timeout}秒）"
+            }
+        except BaseException:
+            # 任务被取消（停止/重启Bot）等情况下结束子进程，避免遗留claude进程
+            await self._kill_process(process)
+            raise
+
+        return self._parse_output(stdout)
+
+    @staticmethod
+    async def _kill_process(process: asyncio.subprocess.Process):
+        """结束子进程并等待其退出（进程已退出时直接返回）"""
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        await process.wait()
+
+    async def _call_stream(
+        self,
+        claude_path: str,
+        message: str,
+        on_text: Callable[[str], Awaitable[None]]
+    ) -> Dict[str, Any]:
+        """
+        流式调用Claude CLI（逐行读取stream-json事件，文本产生后立即回调）
 
+        Args:
+            claude_path: Claude CLI路径
+            message: 用户消息
+            on_text: 文本回调
+
+        Returns:
+            结果字典
+        """
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self._build_command(claude_path, message, stream=True),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                cwd=self._work_dir_str,
+                limit=STREAM_LINE_LIMIT
+            )
+        except NotImplementedError:
+            # 事件循环不支持子进程，退回一次性输出
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._call_sync, claude_path, message)
+        except FileNotFoundError:
+            self._cached_cli_path = None
+            return {
+                "success": False,
+                "error": f"Claude CLI不存在：{claude_path}"
+            }
+
+        state = {"streamed": False, "result": None}
+        try:
+            await asyncio.wait_for(self._read_stream(process, on_text, state), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            await self._kill_process(process)
+            return {
+                "success": False,
+                "error": f"Claude响应超时（超过{self.timeout}秒）",
+                "streamed": state["streamed"]
+            }
+        except BaseException:
+            # 任务被取消（停止/重启Bot）等情况下结束子进程，避免遗留claude进程
+            await self._kill_process(process)
+            raise
+
+        final = state["result"]
+        if final is None:
+            return {
+                "success": state["streamed"],
+                "result": "",
+                "cost_usd": 0,
+                "error": "" if state["streamed"] else "Claude无响应",
+                "streamed": state["streamed"]
+            }
+
+        is_error = final.get("is_error", False)
+        return {
+            "success": not is_error,
+            "result": final.get("result", ""),
+            "cost_usd": final.get("total_cost_usd", final.get("cost_usd", 0)),
+            "error": final.get("result", "") if is_error else "",
+            "streamed": state["streamed"]
+        }
+
+    async def _read_stream(
+        self,
+        process: asyncio.subprocess.Process,
+        on_text: Callable[[str], Awaitable[None]],
+        state: Dict[str, Any]
+    ):
+        """读取stream-json事件：assistant文本立即回调，result事件记录为最终结果"""
+        async for line in process.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+
+            event_type = event.get("type")
+            if event_type == "assistant":
+                for block in event.get("message", {}).get("content", []):
+                    text = block.get("text") if block.get("type") == "text" else None
+                    if not text:
+                        continue
+                    try:
+                        await on_text(text)
+                        state["streamed"] = True
+                    except Exception as e:
+                        self.logger.warning(f"流式发送失败: {e}")
+            elif event_type == "result":
+                state["result"] = event
+
+        await process.wait()
+
+    def _call_sync(self, claude_path: str, message: str) -> Dict[str, Any]:
+        """
+        同步调用Claude CLI（事件循环不支持子进程时使用）
+
+        Args:
+            claude_path: Claude CLI路径
+            message: 用户消息
+
+        Returns:
+            结果字典
+        """
         try:
             result = subprocess.run(
-                cmd,
+                self._build_command(claude_path, message),
                 capture_output=True,
-                encoding='utf-8',
-                errors='replace',
                 timeout=self.timeout,
-                cwd=str(self.work_dir),
+                cwd=self._work_dir_str,
                 check=False
             )
-
-            # 解析输出
-            output = result.stdout.strip()
-            if not output:
-                return {
-                    "success": False,
-                    "error": "Claude无响应"
-                }
-
-            # 尝试解析JSON
-            try:
-                data = json.loads(output)
-            except json.JSONDecodeError:
-                # 如果不是JSON格式，直接返回原始输出
-                return {
-                    "success": True,
-                    "result": output,
-                    "cost_usd": 0
-                }
-
-            # 提取结果
-            if isinstance(data, dict):
-                success = data.get("success", True)
-                result_text = data.get("result", data.get("response", ""))
-                cost = data.get("cost_usd", 0)
-                error = data.get("error", "")
-
-                return {
-                    "success": success,
-                    "result": result_text,
-                    "cost_usd": cost,
-                    "error": error
-                }
-            else:
-                return {
-                    "success": True,
-                    "result": str(data),
-                    "cost_usd": 0
-                }
+            return self._parse_output(result.stdout)
 
         except subprocess.TimeoutExpired:
             return {
@@ -275,6 +419,8 @@ class ClaudeHandler:
                 "error": f"Claude响应超时（超过{self.timeout}秒）"
             }
         except FileNotFoundError:
+            # CLI被移除或移动，下次调用时重新查找
+            self._cached_cli_path = None
             return {
                 "success": False,
                 "error": f"Claude CLI不存在：{claude_path}"
@@ -286,6 +432,59 @@ class ClaudeHandler:
                 "error": f"调用失败: {str(e)}"
             }
 
+    def _parse_output(self, output: bytes) -> Dict[str, Any]:
+        """
+        解析Claude CLI输出
+
+        Args:
+            output: CLI标准输出（原始字节，直接交给orjson解析，不先解码）
+
+        Returns:
+            结果字典
+        """
+        output = output.strip()
+        if not output:
+            return {
+                "success": False,
+                "error": "Claude无响应"
+            }
+
+        # 首字节不像JSON时直接按纯文本处理，避免走异常分支
+        data = None
+        if output[:1] in (b'{', b'[', b'"'):
+            try:
+                data = orjson.loads(output)
+            except orjson.JSONDecodeError:
+                pass
+
+        if data is None:
+            # 如果不是JSON格式，直接返回原始输出
+            return {
+                "success": True,
+                "result": output.decode('utf-8', errors='replace'),
+                "cost_usd": 0
+            }
+
+        # 提取结果
+        if isinstance(data, dict):
+            success = data.get("success", True)
+            result_text = data.get("result", data.get("response", ""))
+            cost = data.get("cost_usd", 0)
+            error = data.get("error", "")
+
+            return {
+                "success": success,
+                "result": result_text,
+                "cost_usd": cost,
+                "error": error
+            }
+        else:
+            return {
+                "success": True,
+                "result": str(data),
+                "cost_usd": 0
+            }
+
     def get_work_dir(self) -> Path:
         """获取工作目录"""
         return self.work_dir
@@ -301,5 +500,6 @@ class ClaudeHandler:
             "max_retries": self.max_retries,
             "initial_backoff": self.initial_backoff,
             "max_backoff": self.max_backoff,
+            "max_concurrent": self.max_concurrent,
             "retryable_errors": self.RETRYABLE_ERRORS
         }
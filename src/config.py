@@ -4,22 +4,32 @@
 import os
 import yaml
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
+
+# 优先使用libyaml的C实现加载器/输出器
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# 配置项不存在的标记
+_MISSING = object()
 
 
 class Config:
     """配置管理类"""
 
-    _instance = None
-    _config: Dict[str, Any] = None
+    def __init__(self, config_path: str = None):
+        """
+        初始化配置（全局共享请使用模块级的 config 实例）
 
-    def __new__(cls, config_path: str = None):
-        """单例模式"""
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            if config_path:
-                cls._instance.load(config_path)
-        return cls._instance
+        Args:
+            config_path: 配置文件路径（可选，提供时立即加载）
+        """
+        self._config: Optional[Dict[str, Any]] = None
+        self._cached_dict: Optional[Dict[str, Any]] = None
+        self._get_cache: Optional[Dict[str, Any]] = None
+
+        if config_path:
+            self.load(config_path)
 
     def load(self, config_path: str):
         """加载配置文件"""
@@ -28,10 +38,11 @@ class Config:
             raise FileNotFoundError(f"配置文件不存在: {config_path}")
 
         with open(path, 'r', encoding='utf-8') as f:
-            self._config = yaml.safe_load(f)
+            self._config = yaml.load(f, Loader=SafeLoader)
 
         # 环境变量覆盖（可选）
         self._load_env_overrides()
+        self._invalidate()
 
         # 创建日志目录
         if self.get('logging.file.enabled', True):
@@ -50,18 +61,28 @@ class Config:
             self._config.setdefault('proxy', {})['no_proxy'] = os.environ['NO_PROXY']
 
     def get(self, key: str, default: Any = None) -> Any:
-        """获取配置项（支持嵌套，用.分隔）"""
+        """获取配置项（支持嵌套，用.分隔，结果按key缓存直到配置变更）"""
         if self._config is None:
             return default
 
-        keys = key.split('.')
+        if self._get_cache is None:
+            self._get_cache = {}
+        try:
+            value = self._get_cache[key]
+        except KeyError:
+            value = self._get_cache[key] = self._lookup(key)
+
+        return default if value is _MISSING else value
+
+    def _lookup(self, key: str) -> Any:
+        """按.分隔的路径查找配置项，不存在时返回_MISSING"""
         value = self._config
 
-        for k in keys:
+        for k in key.split('.'):
             if isinstance(value, dict) and k in value:
                 value = value[k]
             else:
-                return default
+                return _MISSING
 
         return value
 
@@ -79,17 +100,25 @@ class Config:
             config = config[k]
 
         config[keys[-1]] = value
+        self._invalidate()
+
+    def _invalidate(self):
+        """配置变更后清除缓存的字典快照"""
+        self._cached_dict = None
+        self._get_cache = None
 
     def save(self, config_path: str):
         """保存配置到文件"""
         path = Path(config_path)
         with open(path, 'w', encoding='utf-8') as f:
-            yaml.dump(self._config, f, allow_unicode=True, sort_keys=False)
+            yaml.dump(self._config, f, Dumper=SafeDumper, allow_unicode=True, sort_keys=False)
 
     def to_dict(self) -> Dict[str, Any]:
-        """返回配置字典"""
-        return self._config.copy() if self._config else {}
+        """返回配置字典（缓存的快照，配置变更后自动失效，调用方不应修改）"""
+        if self._cached_dict is None:
+            self._cached_dict = self._config.copy() if self._config else {}
+        return self._cached_dict
 
 
-# 全局配置实例
+# 全局配置实例（单例）
 config = Config()
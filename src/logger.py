@@ -1,11 +1,17 @@
 """
 日志系统模块
 """
+import sys
+import queue
+import atexit
 import logging
 import logging.handlers
-import sys
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Dict
+
+
+# 各日志器对应的后台写日志线程（重复配置时先停止旧的）
+_listeners: Dict[str, logging.handlers.QueueListener] = {}
 
 
 def setup_logger(
@@ -29,11 +35,21 @@ def setup_logger(
 
     Returns:
         配置好的Logger实例
+
+    Note:
+        控制台和文件的实际写入在后台线程中进行，日志调用只负责把记录放入队列，
+        不会因磁盘I/O阻塞事件循环。
     """
     logger = logging.getLogger(name)
     logger.setLevel(getattr(logging, level.upper()))
     logger.handlers.clear()  # 清除已有的handler
 
+    old_listener = _listeners.pop(name, None)
+    if old_listener:
+        old_listener.stop()
+
+    handlers = []
+
     # 日志格式
     formatter = logging.Formatter(
         fmt='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
@@ -45,7 +61,7 @@ def setup_logger(
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(logging.DEBUG)
         console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        handlers.append(console_handler)
 
     # 文件输出
     if log_file:
@@ -60,11 +76,27 @@ def setup_logger(
         )
         file_handler.setLevel(logging.DEBUG)
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+
+    # 日志器只挂QueueHandler，由QueueListener在后台线程写出
+    if handlers:
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners[name] = listener
 
     return logger
 
 
+@atexit.register
+def _stop_listeners():
+    """退出时停止后台写日志线程（会先写完队列中剩余的日志）"""
+    for listener in _listeners.values():
+        listener.stop()
+    _listeners.clear()
+
+
 def get_logger(name: str = "claude-qq-bridge") -> logging.Logger:
     """获取Logger实例"""
     return logging.getLogger(name)
@@ -1,23 +1,93 @@
 """
 OneBot WebSocket客户端
 """
-import json
+import re
+import time
+import random
 import asyncio
+import orjson
 import websockets
 from typing import Callable, Dict, Any, Optional
 import logging
 
 
+# 单条消息最大尺寸（4MB，长回复的消息回显可能较大）
+MAX_MESSAGE_SIZE = 2 ** 22
+
+# 协议层保活（由websockets自动发送ping，超时未收到pong则断开连接）
+PING_INTERVAL = 30
+PING_TIMEOUT = 20
+
+# 顶层post_type字段（消息正文中的引号会被转义，不会误匹配）
+_POST_TYPE_RE = re.compile(r'"post_type"\s*:\s*"([^"]+)"')
+
+# 无需完整解析、直接丢弃的事件类型（心跳、生命周期等元事件）
+SKIPPED_POST_TYPES = frozenset({'meta_event'})
+
+
+def _peek_post_type(raw) -> Optional[str]:
+    """
+    不完整解析JSON，直接提取事件的post_type
+
+    Args:
+        raw: WebSocket收到的原始帧
+
+    Returns:
+        post_type，未找到（如API响应或二进制帧）时返回None
+    """
+    if not isinstance(raw, str):
+        return None
+    match = _POST_TYPE_RE.search(raw)
+    return match.group(1) if match else None
+
+
+class TokenBucket:
+    """令牌桶限速器（用于控制消息发送频率）"""
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        初始化令牌桶
+
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶容量（允许的突发数量）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """获取一个令牌，令牌不足时等待补充"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
 class OneBotClient:
     """OneBot WebSocket客户端"""
 
+    # 发送消息的请求模板（只替换目标ID和消息内容，省去构造dict和整体序列化）
+    PRIVATE_MSG_TEMPLATE = b'{"action":"send_private_msg","params":{"user_id":%s,"message":%s}}'
+    GROUP_MSG_TEMPLATE = b'{"action":"send_group_msg","params":{"group_id":%s,"message":%s}}'
+
     def __init__(
         self,
         ws_url: str,
         on_message: Callable[[Dict[str, Any]], None],
         logger: logging.Logger,
         reconnect_interval: int = 5,
-        timeout: int = 30
+        timeout: int = 30,
+        send_rate: float = 2.0,
+        send_burst: int = 3,
+        max_retries: int = 0
     ):
         """
         初始化OneBot客户端
@@ -26,53 +96,91 @@ class OneBotClient:
             ws_url: WebSocket地址（ws://host:port）
             on_message: 消息回调函数
             logger: 日志器
-            reconnect_interval: 重连间隔（秒）
+            reconnect_interval: 最大重连间隔（秒）
             timeout: 连接超时（秒）
+            send_rate: 消息发送速率（条/秒）
+            send_burst: 允许连续突发发送的条数
+            max_retries: 最大连续重连次数（0为不限）
         """
         self.ws_url = ws_url
         self.on_message = on_message
         self.logger = logger
         self.reconnect_interval = reconnect_interval
+        self.max_retries = max_retries
         self.timeout = timeout
         self.websocket: Optional[websockets.WebSocketClientProtocol] = None
         self.running = False
-        self.heartbeat_task = None
 
         # 连接状态跟踪
         self.connected = False
-        self.last_heartbeat_time = None
+        self.last_heartbeat_time: Optional[float] = None  # 最后一次心跳时间（time.monotonic）
+        self.last_received_time: Optional[float] = None  # 最后一次收到数据的时间（time.monotonic）
+
+        # 消息发送限速（避免触发QQ频率限制，令牌充足时不等待）
+        self.send_limiter = TokenBucket(rate=send_rate, capacity=send_burst)
+
+        # 发送队列（由单个写任务按顺序写出，发送方无需等待socket写入）
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        self.writer_task: Optional[asyncio.Task] = None
 
     async def connect(self):
-        """连接到OneBot服务器"""
+        """
+        连接到OneBot服务器
+
+        连接失败时按指数退避重试（0.2秒起，上限为reconnect_interval），
+        NapCat短暂重启时能快速恢复，长时间断开时也不会频繁重连。
+
+        Raises:
+            ConnectionError: 连续失败次数超过max_retries
+        """
+        self.running = True
+        attempt = 0
+        backoff = 0.2
         while self.running:
             try:
-                self.logger.info(f"正在连接到 OneBot: {self.ws_url}")
+                self.logger.info("正在连接到 OneBot: %s", self.ws_url)
+                # 本地连接不需要压缩，关闭permessage-deflate节省CPU
+                # 保活ping由websockets内部处理，无需单独的心跳任务
                 self.websocket = await asyncio.wait_for(
-                    websockets.connect(self.ws_url),
+                    websockets.connect(
+                        self.ws_url,
+                        max_size=MAX_MESSAGE_SIZE,
+                        compression=None,
+                        ping_interval=PING_INTERVAL,
+                        ping_timeout=PING_TIMEOUT
+                    ),
                     timeout=self.timeout
                 )
                 self.connected = True
-                self.last_heartbeat_time = asyncio.get_event_loop().time()
+                self.last_heartbeat_time = time.monotonic()
                 self.logger.info("OneBot 连接成功")
                 break
             except Exception as e:
                 self.connected = False
-                self.logger.error(f"OneBot 连接失败: {e}, {self.reconnect_interval}秒后重试...")
-                await asyncio.sleep(self.reconnect_interval)
+                attempt += 1
+                if self.max_retries and attempt > self.max_retries:
+                    self.running = False
+                    raise ConnectionError(f"OneBot 连接失败，已重试{self.max_retries}次: {e}") from e
+                delay = min(self.reconnect_interval, backoff) + random.uniform(0, 0.1)
+                # 达到上限后不再翻倍（长时间断开时重试次数可能很多）
+                backoff = min(backoff * 2, self.reconnect_interval)
+                self.logger.error("OneBot 连接失败: %s, %.1f秒后重试...", e, delay)
+                await asyncio.sleep(delay)
 
     async def disconnect(self):
         """断开连接"""
         self.running = False
         self.connected = False
-        if self.heartbeat_task:
-            self.heartbeat_task.cancel()
+        if self.writer_task:
+            self.writer_task.cancel()
             try:
-                await self.heartbeat_task
+                await self.writer_task
             except asyncio.CancelledError:
                 pass
-            self.heartbeat_task = None
+            self.writer_task = None
 
         if self.websocket:
+            await self._flush_outbox()
             await self.websocket.close()
             self.logger.info("OneBot 连接已断开")
 
@@ -82,40 +190,59 @@ class OneBotClient:
             raise RuntimeError("WebSocket未连接")
 
         self.running = True
-        self.heartbeat_task = asyncio.create_task(self._heartbeat())
+        if self.writer_task is None or self.writer_task.done():
+            self.writer_task = asyncio.create_task(self._writer())
 
+        # 连接状态在监听结束时（断开、异常、任务取消）统一置为False，
+        # is_connected和发送时只需读取这一标志
         try:
             async for message in self.websocket:
+                self.last_received_time = time.monotonic()
+                # 元事件（OneBot心跳等）只用于确认连接存活，跳过完整解析
+                if _peek_post_type(message) in SKIPPED_POST_TYPES:
+                    self.last_heartbeat_time = self.last_received_time
+                    continue
                 try:
-                    data = json.loads(message)
+                    data = orjson.loads(message)
                     await self.on_message(data)
-                except json.JSONDecodeError as e:
-                    self.logger.error(f"解析消息失败: {e}")
+                except orjson.JSONDecodeError as e:
+                    # 格式错误的帧属于可预期的情况，只记一行，不记录堆栈
+                    self.logger.warning("解析消息失败（%d字节）: %s", len(message), e)
                 except Exception as e:
-                    self.logger.error(f"处理消息失败: {e}", exc_info=True)
+                    self.logger.error("处理消息失败: %s", e, exc_info=True)
         except websockets.exceptions.ConnectionClosed:
             self.logger.warning("OneBot 连接已关闭")
             self.connected = False
             await self._reconnect()
         except Exception as e:
-            self.logger.error(f"OneBot 监听错误: {e}", exc_info=True)
+            self.logger.error("OneBot 监听错误: %s", e, exc_info=True)
             self.connected = False
             await self._reconnect()
+        finally:
+            self.connected = False
 
-    async def _heartbeat(self):
-        """心跳保活"""
-        while self.running and self.websocket:
+    async def _writer(self):
+        """写任务：按顺序取出队列中的帧并写出"""
+        while True:
+            message = await self.outbox.get()
             try:
-                await asyncio.sleep(30)  # 30秒一次心跳
-                if self.websocket and not self.websocket.closed:
-                    # 发送心跳
-                    await self.websocket.ping()
-                    self.last_heartbeat_time = asyncio.get_event_loop().time()
-                    self.logger.debug("心跳发送成功")
+                await self.websocket.send(message)
             except Exception as e:
-                self.logger.error(f"心跳失败: {e}")
+                self.logger.error("发送消息失败: %s", e)
                 self.connected = False
-                break
+
+    async def _flush_outbox(self):
+        """断开前尽量写出队列中剩余的帧，无法写出的记录后丢弃"""
+        while not self.outbox.empty():
+            message = self.outbox.get_nowait()
+            try:
+                await self.websocket.send(message)
+            except Exception as e:
+                dropped = self.outbox.qsize() + 1
+                while not self.outbox.empty():
+                    self.outbox.get_nowait()
+                self.logger.warning("断开连接时有%d条消息未能发送: %s", dropped, e)
+                return
 
     async def _reconnect(self):
         """重新连接"""
@@ -135,14 +262,14 @@ class OneBotClient:
             True: 已连接且活跃
             False: 未连接或已断开
         """
-        return self.connected and self.websocket and not self.websocket.closed
+        return self.connected
 
     def get_last_heartbeat_time(self) -> Optional[float]:
         """
         获取最后一次心跳时间
 
         Returns:
-            最后心跳时间戳，如果从未心跳则返回None
+            最后心跳时间（time.monotonic），如果从未心跳则返回None
         """
         return self.last_heartbeat_time
 
@@ -150,41 +277,40 @@ class OneBotClient:
         """
         发送消息到OneBot
 
+        消息只放入发送队列即返回（不等待写出），写出时的错误由写任务记录日志，不会抛给调用方。
+
         Args:
             data: 消息数据（会自动添加action字段）
         """
-        if not self.websocket or self.websocket.closed:
+        await self._send_frame(orjson.dumps(data))
+
+    async def _send_frame(self, frame: bytes):
+        """
+        将已序列化的JSON帧放入发送队列（由写任务写出，不等待写出结果）
+
+        Args:
+            frame: JSON字节串
+        """
+        if not self.connected:
             self.logger.error("WebSocket未连接，无法发送消息")
             raise ConnectionError("WebSocket未连接")
 
-        try:
-            message = json.dumps(data, ensure_ascii=False)
-            await self.websocket.send(message)
-            self.logger.debug(f"发送消息: {message}")
-        except Exception as e:
-            self.logger.error(f"发送消息失败: {e}")
-            self.connected = False
-            raise
+        # 以文本帧发送（部分OneBot实现不接受二进制帧）
+        message = frame.decode()
+        self.outbox.put_nowait(message)
+        # 完整报文可能很长，未开启DEBUG时不做任何格式化
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("发送消息: %s", message)
 
     async def send_private_message(self, user_id: int, message: str):
         """发送私聊消息"""
-        await self.send({
-            "action": "send_private_msg",
-            "params": {
-                "user_id": user_id,
-                "message": message
-            }
-        })
+        await self.send_limiter.acquire()
+        await self._send_frame(self.PRIVATE_MSG_TEMPLATE % (orjson.dumps(user_id), orjson.dumps(message)))
 
     async def send_group_message(self, group_id: int, message: str):
         """发送群聊消息"""
-        await self.send({
-            "action": "send_group_msg",
-            "params": {
-                "group_id": group_id,
-                "message": message
-            }
-        })
+        await self.send_limiter.acquire()
+        await self._send_frame(self.GROUP_MSG_TEMPLATE % (orjson.dumps(group_id), orjson.dumps(message)))
 
     async def get_friend_list(self) -> Optional[Dict[str, Any]]:
         """获取好友列表"""
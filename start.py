@@ -10,6 +10,9 @@ import os
 import argparse
 import subprocess
 import signal
+import shutil
+import functools
+import io
 import requests
 import zipfile
 from pathlib import Path
@@ -19,6 +22,7 @@ from pathlib import Path
 NAPCAT_DIR = Path(__file__).parent / "napcat"
 NAPCAT_DOWNLOAD_URL = "https://github.com/NapNeko/NapCatQQ/releases/latest/download/NapCatQQ.zip"
 NAPCAT_EXE = NAPCAT_DIR / "NapCatWinBootMain.exe"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 下载时每次读写的字节数（1MB）
 
 
 def install_napcat():
@@ -38,26 +42,22 @@ def install_napcat():
     # 下载
     print(f"正在从 {NAPCAT_DOWNLOAD_URL} 下载NapCat...")
     try:
-        response = requests.get(NAPCAT_DOWNLOAD_URL, stream=True)
-        response.raise_for_status()
+        # zip本身已压缩，要求服务器不再做gzip编码，直接按原始字节大块读取
+        # 安装包放在内存中直接解压，解压后即释放，不在napcat/目录留下zip
+        with io.BytesIO() as buffer:
+            with requests.get(NAPCAT_DOWNLOAD_URL, stream=True, headers={'Accept-Encoding': 'identity'}) as response:
+                response.raise_for_status()
+                shutil.copyfileobj(response.raw, buffer, length=DOWNLOAD_CHUNK_SIZE)
 
-        # 保存到临时文件
-        temp_zip = NAPCAT_DIR / "NapCatQQ.zip"
-        with open(temp_zip, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+            print("✅ 下载完成")
 
-        print("✅ 下载完成")
+            # 解压
+            print("正在解压...")
+            buffer.seek(0)
+            with zipfile.ZipFile(buffer, 'r') as zip_ref:
+                zip_ref.extractall(NAPCAT_DIR.parent)
 
-        # 解压
-        print("正在解压...")
-        with zipfile.ZipFile(temp_zip, 'r') as zip_ref:
-            zip_ref.extractall(NAPCAT_DIR.parent)
-
-        print("✅ 解压完成")
-
-        # 删除zip文件
-        temp_zip.unlink()
+            print("✅ 解压完成")
 
         print(f"✅ NapCat安装成功: {NAPCAT_DIR}")
 
@@ -116,10 +116,11 @@ def start_napcat():
 
     print(f"正在启动NapCat: {NAPCAT_EXE}")
     try:
+        # 子进程输出不读取，重定向到DEVNULL，避免管道写满后子进程阻塞
         process = subprocess.Popen(
             [str(NAPCAT_EXE)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
         )
         print(f"✅ NapCat已启动 (PID: {process.pid})")
         print("请在NapCat GUI中:")
@@ -164,17 +165,29 @@ def daemonize():
     sys.stderr.close()
 
 
+def read_daemon_config() -> dict:
+    """读取config.yaml中的daemon配置（文件未修改时复用上次的解析结果）"""
+    config_path = Path(__file__).parent / "config.yaml"
+    return _load_daemon_config(str(config_path), config_path.stat().st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_daemon_config(config_path: str, mtime_ns: int) -> dict:
+    """解析配置文件并取出daemon部分（mtime_ns仅作为缓存键）"""
+    import yaml
+    from src.config import SafeLoader  # 优先使用libyaml的C实现
+
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config_data = yaml.load(f, Loader=SafeLoader) or {}
+    return config_data.get('daemon', {})
+
+
 def start_daemon():
     """启动daemon模式"""
     print("正在启动后台daemon...")
 
     # 读取配置
-    import yaml
-    config_path = Path(__file__).parent / "config.yaml"
-    with open(config_path, 'r', encoding='utf-8') as f:
-        config_data = yaml.safe_load(f)
-
-    daemon_config = config_data.get('daemon', {})
+    daemon_config = read_daemon_config()
     pid_file = Path(daemon_config.get('pid_file', '/tmp/claude-qq-bridge.pid'))
     log_file = Path(daemon_config.get('log_file', 'logs/daemon.log'))
 
@@ -210,12 +223,7 @@ def start_daemon():
 
 def stop_daemon():
     """停止daemon"""
-    import yaml
-    config_path = Path(__file__).parent / "config.yaml"
-    with open(config_path, 'r', encoding='utf-8') as f:
-        config_data = yaml.safe_load(f)
-
-    daemon_config = config_data.get('daemon', {})
+    daemon_config = read_daemon_config()
     pid_file = Path(daemon_config.get('pid_file', '/tmp/claude-qq-bridge.pid'))
 
     if not pid_file.exists():
@@ -275,7 +283,10 @@ def start_services(daemon=False):
             on_message=None,  # 稍后设置
             logger=logger,
             reconnect_interval=config.get('network.reconnect_interval', 5),
-            timeout=config.get('network.timeout', 30)
+            timeout=config.get('network.timeout', 30),
+            send_rate=config.get('network.send_rate', 2.0),
+            send_burst=config.get('network.send_burst', 3),
+            max_retries=config.get('network.reconnect_max_retries', 0)
         )
 
         # 创建Claude处理器
@@ -283,6 +294,7 @@ def start_services(daemon=False):
             cli_path=config.get('claude.cli_path', 'claude'),
             work_dir=config.get('claude.work_dir', '.'),
             timeout=config.get('claude.timeout', 300),
+            max_concurrent=config.get('claude.max_concurrent', 4),
             logger=logger
         )
 
@@ -294,18 +306,37 @@ def start_services(daemon=False):
             logger=logger
         )
 
-        # 设置消息回调
-        onebot_client.on_message = lambda data: asyncio.create_task(bot_client.on_message(data))
-
-        # 连接OneBot
-        logger.info("正在连接到NapCat (OneBot)...")
-        await onebot_client.connect()
+        # 收到SIGTERM（stop_daemon）时取消主任务，走下面的清理流程正常退出
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass  # Windows不支持add_signal_handler
 
-        # 监听消息
-        logger.info("开始监听消息...")
-        await onebot_client.listen()
+        # 设置消息回调（消息进入队列，由worker并发处理）
+        onebot_client.on_message = bot_client.enqueue_message
+        await bot_client.start_worker()
 
-    # 运行Bot
+        try:
+            # 连接OneBot
+            logger.info("正在连接到NapCat (OneBot)...")
+            await onebot_client.connect()
+
+            # 监听消息
+            logger.info("开始监听消息...")
+            await onebot_client.listen()
+        except asyncio.CancelledError:
+            logger.info("收到停止信号，正在退出...")
+        finally:
+            await bot_client.stop_worker()
+            await onebot_client.disconnect()
+            logger.info("Bot已停止")
+
+    # 运行Bot（优先使用uvloop，Windows不支持时退回标准asyncio）
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     asyncio.run(run_bot())
 
 
@@ -348,17 +379,17 @@ def start_all():
     print("Streamlit WebUI: http://127.0.0.1:8501")
     print("按 Ctrl+C 停止服务\n")
 
-    # 启动API和WebUI（子进程）
+    # 启动API和WebUI（子进程，输出不读取，重定向到DEVNULL避免管道写满阻塞）
     api_process = subprocess.Popen(
         [sys.executable, "-m", "uvicorn", "api.app:app", "--host", "127.0.0.1", "--port", "8000"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
     )
 
     webui_process = subprocess.Popen(
         [sys.executable, "-m", "streamlit", "run", "webui/app.py", "--server.port", "8501", "--server.address", "127.0.0.1"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
     )
 
     try:
@@ -415,17 +446,17 @@ def start_all_with_napcat():
     print("[4/4] 启动ClauQBot服务...")
     print()
 
-    # 启动API和WebUI（子进程）
+    # 启动API和WebUI（子进程，输出不读取，重定向到DEVNULL避免管道写满阻塞）
     api_process = subprocess.Popen(
         [sys.executable, "-m", "uvicorn", "api.app:app", "--host", "127.0.0.1", "--port", "8000"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
     )
 
     webui_process = subprocess.Popen(
         [sys.executable, "-m", "streamlit", "run", "webui/app.py", "--server.port", "8501", "--server.address", "127.0.0.1"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
     )
 
     # 启动Bot（在当前线程）
@@ -3,16 +3,98 @@ Streamlit WebUI前端
 """
 import streamlit as st
 import requests
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import copy
 import time
-from pathlib import Path
-import sys
-
-# 添加项目根目录到路径
-sys.path.insert(0, str(Path(__file__).parent.parent))
+from concurrent.futures import ThreadPoolExecutor
 
 # API地址
 API_URL = "http://127.0.0.1:8000"
 
+# 请求超时（连接超时, 读取超时），后端不可用时不让页面一直卡住
+API_TIMEOUT = (1, 5)
+# 启动/重启Bot需要等待OneBot连接，读取超时放宽
+CONTROL_TIMEOUT = (1, 30)
+
+# 请求体由orjson序列化后直接发送
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# 日志级别选项及其下标
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+LOG_LEVEL_INDEX = {level: i for i, level in enumerate(LOG_LEVELS)}
+
+MB = 1 << 20
+DEFAULT_PREFIXES = ('/c', '/claude', '/问', '/ask')
+DEFAULT_PREFIX_STR = ', '.join(DEFAULT_PREFIXES)
+
+# 配置页各项的默认值（键为“节.项”形式，与Config.get的写法一致）
+CONFIG_DEFAULTS = {
+    'network.onebot_ws_url': 'ws://127.0.0.1:8081',
+    'network.reconnect_interval': 5,
+    'network.timeout': 30,
+    'proxy.enabled': False,
+    'proxy.http_proxy': '',
+    'proxy.https_proxy': '',
+    'proxy.no_proxy': 'localhost,127.0.0.1',
+    'claude.cli_path': 'claude',
+    'claude.work_dir': '.',
+    'claude.timeout': 300,
+    'claude.max_retries': 3,
+    'claude.initial_backoff': 1.0,
+    'claude.max_backoff': 60.0,
+    'bot.qq_number': '',
+    'bot.auto_reply_private': True,
+    'bot.ignore_temp_session': True,
+    'bot.command_prefix': DEFAULT_PREFIXES,
+    'bot.heartbeat_enabled': True,
+    'bot.heartbeat_interval': 60,
+    'bot.max_connection_failures': 3,
+    'logging.level': 'INFO',
+    'logging.console': True,
+    'logging.file.enabled': True,
+    'logging.file.path': 'logs/app.log',
+    'logging.file.max_size': 10 * MB,
+    'logging.file.backup_count': 5,
+    'api.enabled': True,
+    'api.host': '127.0.0.1',
+    'api.port': 8000,
+    'webui.enabled': True,
+    'webui.host': '127.0.0.1',
+    'webui.port': 8501,
+}
+
+# 同一会话两次获取状态的最小间隔（秒），连续点击引起的重新运行直接复用结果
+STATUS_DEBOUNCE = 0.25
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """
+    获取共享的HTTP会话（复用到API的keep-alive连接）
+
+    Streamlit每次交互都会重新执行整个脚本，用cache_resource保证会话只创建一次。
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=1, backoff_factor=0.1)
+    )
+    session.mount("http://", adapter)
+    return session
+
+
+SESSION = get_session()
+
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    """获取共享的线程池（用于并发请求API）"""
+    return ThreadPoolExecutor(max_workers=4)
+
+
 # 页面配置
 st.set_page_config(
     page_title="ClauQBot",
@@ -46,72 +128,265 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
+@st.cache_data(ttl=2.0)
+def _cached_status():
+    """获取服务状态（短时间内的重复请求直接使用缓存）"""
+    return orjson.loads(SESSION.get(f"{API_URL}/status", timeout=API_TIMEOUT).content)
+
+
+@st.cache_data(ttl=10.0)
+def _cached_config():
+    """获取配置（短时间内的重复请求直接使用缓存）"""
+    return orjson.loads(SESSION.get(f"{API_URL}/config", timeout=API_TIMEOUT).content)
+
+
+def flatten_config(config, prefix=""):
+    """将嵌套配置展开为“节.项”形式的单层dict"""
+    flat = {}
+    for key, value in config.items():
+        if isinstance(value, dict):
+            flat.update(flatten_config(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def set_config_state(config):
+    """保存当前配置到会话状态，并预先展开、合并默认值供配置页控件读取"""
+    st.session_state.cfg = config
+    st.session_state.cfg_original = copy.deepcopy(config)  # 加载时的快照，保存时据此找出变化项
+    st.session_state.cfg_flat = {**CONFIG_DEFAULTS, **flatten_config(config)}
+
+
+def load_config_state():
+    """从后端获取配置并保存到会话状态（获取失败时保持原状态不变）"""
+    config = get_config()
+    if config is not None:
+        set_config_state(config)
+
+
+def clear_cache():
+    """Bot状态或配置变化后清空缓存，保证页面显示最新状态"""
+    _cached_status.clear()
+    _cached_config.clear()
+
+
 def get_status():
-    """获取服务状态"""
+    """获取服务状态（同一会话短时间内连续重新运行时复用上一次结果）"""
+    last_status = st.session_state.get('_last_status')
+    if last_status is not None:
+        # 控制按钮操作后紧接着的那次重新运行直接使用本地设置的状态
+        if st.session_state.pop('_skip_next_poll', False):
+            return last_status
+        if time.monotonic() - st.session_state._last_status_fetch < STATUS_DEBOUNCE:
+            return last_status
+
     try:
-        response = requests.get(f"{API_URL}/status")
-        return response.json()
+        status = _cached_status()
     except Exception as e:
-        return {"bot_running": False, "bot_task_running": False, "error": str(e)}
+        status = {"bot_running": False, "bot_task_running": False, "error": str(e)}
+
+    # 多worker时请求可能由不运行Bot的worker处理，其结果不代表Bot的实际状态，沿用上一次结果
+    if status.get('bot_owner') is False and last_status is not None:
+        return last_status
+
+    st.session_state._last_status = status
+    st.session_state._last_status_fetch = time.monotonic()
+    return status
+
+
+def set_local_status(bot_running: bool):
+    """控制按钮成功后先在本地更新运行状态，下一次重新运行不再请求后端"""
+    st.session_state._last_status = {**st.session_state.get('_last_status', {}), "bot_running": bot_running}
+    st.session_state._last_status_fetch = time.monotonic()
+    st.session_state._skip_next_poll = True
 
 
 def get_detailed_status():
     """获取详细的服务状态"""
     try:
-        response = requests.get(f"{API_URL}/status/detailed")
-        return response.json()
+        response = SESSION.get(f"{API_URL}/status/detailed", timeout=API_TIMEOUT)
+        return orjson.loads(response.content)
     except Exception as e:
         return {}
 
 
+def _get_json(path: str):
+    """GET请求API并返回JSON（失败时抛出异常）"""
+    response = SESSION.get(f"{API_URL}{path}", timeout=API_TIMEOUT)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+
+def fetch_dashboard():
+    """
+    获取系统状态页数据（详细状态、API服务信息、配置）
+
+    优先使用后端的/dashboard接口一次取回；旧版后端没有该接口时退回逐个请求。
+    """
+    try:
+        response = SESSION.get(f"{API_URL}/dashboard", timeout=API_TIMEOUT)
+        if response.status_code != 404:
+            response.raise_for_status()
+            return orjson.loads(response.content)
+    except Exception as e:
+        return {"status": {}, "root": None, "config": {}, "error": str(e)}
+
+    # 三个请求同时发出（线程中只做HTTP请求，不调用st.*）
+    executor = get_executor()
+    status_future = executor.submit(get_detailed_status)
+    root_future = executor.submit(_get_json, "/")
+    config_future = executor.submit(_get_json, "/config")
+
+    dashboard = {"status": status_future.result(), "root": None, "config": {}, "error": None}
+    try:
+        dashboard["root"] = root_future.result()
+    except Exception as e:
+        dashboard["error"] = str(e)
+    try:
+        dashboard["config"] = config_future.result()
+    except Exception as e:
+        st.error(f"获取配置失败: {e}")
+    return dashboard
+
+
 def get_config():
-    """获取配置"""
+    """获取配置（失败时返回None）"""
     try:
-        response = requests.get(f"{API_URL}/config")
-        return response.json()
+        return _cached_config()
     except Exception as e:
         st.error(f"获取配置失败: {e}")
-        return {}
+        return None
 
 
-def update_config(config_data):
-    """更新配置"""
+def update_config(config_data, patch=None):
+    """
+    更新配置
+
+    Args:
+        config_data: 完整配置
+        patch: 只包含变化项的配置；提供时优先以PATCH方式发送，后端不支持时退回发送完整配置
+    """
     try:
-        response = requests.post(f"{API_URL}/config", json=config_data)
-        return response.json()
+        if patch is not None:
+            response = SESSION.patch(f"{API_URL}/config", data=orjson.dumps(patch), headers=JSON_HEADERS, timeout=API_TIMEOUT)
+            if response.status_code != 405:
+                return orjson.loads(response.content)
+        response = SESSION.post(f"{API_URL}/config", data=orjson.dumps(config_data), headers=JSON_HEADERS, timeout=API_TIMEOUT)
+        return orjson.loads(response.content)
     except Exception as e:
         st.error(f"更新配置失败: {e}")
         return {"status": "error"}
+    finally:
+        clear_cache()
+
+
+def diff_config(old, new):
+    """比较新旧配置，返回只包含变化项的嵌套dict"""
+    patch = {}
+    for key, value in new.items():
+        old_value = old.get(key)
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            changed = diff_config(old_value, value)
+            if changed:
+                patch[key] = changed
+        elif key not in old or value != old_value:
+            patch[key] = value
+    return patch
 
 
 def start_bot():
     """启动Bot"""
     try:
-        response = requests.post(f"{API_URL}/bot/start")
-        return response.json()
+        response = SESSION.post(f"{API_URL}/bot/start", timeout=CONTROL_TIMEOUT)
+        return orjson.loads(response.content)
     except Exception as e:
-        st.error(f"启动Bot失败: {e}")
-        return {"status": "error"}
+        return {"status": "error", "message": str(e)}
+    finally:
+        clear_cache()
 
 
 def stop_bot():
     """停止Bot"""
     try:
-        response = requests.post(f"{API_URL}/bot/stop")
-        return response.json()
+        response = SESSION.post(f"{API_URL}/bot/stop", timeout=CONTROL_TIMEOUT)
+        return orjson.loads(response.content)
     except Exception as e:
-        st.error(f"停止Bot失败: {e}")
-        return {"status": "error"}
+        return {"status": "error", "message": str(e)}
+    finally:
+        clear_cache()
 
 
 def restart_bot():
     """重启Bot"""
     try:
-        response = requests.post(f"{API_URL}/bot/restart")
-        return response.json()
+        response = SESSION.post(f"{API_URL}/bot/restart", timeout=CONTROL_TIMEOUT)
+        return orjson.loads(response.content)
     except Exception as e:
-        st.error(f"重启Bot失败: {e}")
-        return {"status": "error"}
+        return {"status": "error", "message": str(e)}
+    finally:
+        clear_cache()
+
+
+def run_bot_action(action, bot_running: bool, success_message: str, error_label: str):
+    """
+    控制按钮回调：执行操作，成功时在本地更新运行状态
+
+    Args:
+        action: start_bot / stop_bot / restart_bot
+        bot_running: 操作成功后Bot是否处于运行状态
+        success_message: 成功提示
+        error_label: 失败提示前缀
+    """
+    result = action()
+    if result.get('status') == 'success':
+        set_local_status(bot_running)
+        st.session_state._bot_action_result = ('success', success_message)
+    else:
+        st.session_state._bot_action_result = ('error', f"{error_label}: {result.get('message')}")
+
+
+@st.fragment(run_every=2.0)
+def sidebar_controls():
+    """
+    侧边栏的Bot状态和控制按钮
+
+    作为fragment每2秒单独刷新状态，刷新时不会重新运行整个页面。
+    """
+    # 状态
+    status = get_status()
+    bot_running = status.get('bot_running', False)
+
+    if bot_running:
+        st.markdown('<div class="status-running">● Bot 运行中</div>', unsafe_allow_html=True)
+    else:
+        st.markdown('<div class="status-stopped">● Bot 已停止</div>', unsafe_allow_html=True)
+
+    st.divider()
+
+    # Bot控制按钮（操作在回调中完成，回调后fragment重新运行时即显示新状态，无需st.rerun）
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        st.button("▶️ 启动", use_container_width=True, disabled=bot_running,
+                  on_click=run_bot_action, args=(start_bot, True, "Bot启动成功！", "启动失败"))
+
+    with col2:
+        st.button("⏹️ 停止", use_container_width=True, disabled=not bot_running,
+                  on_click=run_bot_action, args=(stop_bot, False, "Bot已停止", "停止失败"))
+
+    with col3:
+        st.button("🔄 重启", use_container_width=True, disabled=not bot_running,
+                  on_click=run_bot_action, args=(restart_bot, True, "Bot已重启", "重启失败"))
+
+    # 上一次操作的结果
+    action_result = st.session_state.pop('_bot_action_result', None)
+    if action_result is not None:
+        level, message = action_result
+        if level == 'success':
+            st.success(message)
+        else:
+            st.error(message)
 
 
 def main():
@@ -124,49 +399,8 @@ def main():
     with st.sidebar:
         st.header("控制面板")
 
-        # 状态
-        status = get_status()
-        bot_running = status.get('bot_running', False)
-
-        if bot_running:
-            st.markdown('<div class="status-running">● Bot 运行中</div>', unsafe_allow_html=True)
-        else:
-            st.markdown('<div class="status-stopped">● Bot 已停止</div>', unsafe_allow_html=True)
-
-        st.divider()
-
-        # Bot控制按钮
-        col1, col2, col3 = st.columns(3)
-
-        with col1:
-            if st.button("▶️ 启动", use_container_width=True, disabled=bot_running):
-                result = start_bot()
-                if result.get('status') == 'success':
-                    st.success("Bot启动成功！")
-                    time.sleep(1)
-                    st.rerun()
-                else:
-                    st.error(f"启动失败: {result.get('message')}")
-
-        with col2:
-            if st.button("⏹️ 停止", use_container_width=True, disabled=not bot_running):
-                result = stop_bot()
-                if result.get('status') == 'success':
-                    st.success("Bot已停止")
-                    time.sleep(1)
-                    st.rerun()
-                else:
-                    st.error(f"停止失败: {result.get('message')}")
-
-        with col3:
-            if st.button("🔄 重启", use_container_width=True, disabled=not bot_running):
-                result = restart_bot()
-                if result.get('status') == 'success':
-                    st.success("Bot已重启")
-                    time.sleep(1)
-                    st.rerun()
-                else:
-                    st.error(f"重启失败: {result.get('message')}")
+        # 状态和Bot控制按钮
+        sidebar_controls()
 
         st.divider()
 
@@ -221,311 +455,324 @@ def main():
     elif page == "⚙️ 配置管理":
         st.header("配置管理")
 
-        # 获取当前配置
-        config = get_config()
-
-        # 分组显示配置
-        tab1, tab2, tab3, tab4, tab5 = st.tabs([
-            "🌐 网络配置",
-            "🤖 Claude配置",
-            "🎯 Bot配置",
-            "📝 日志配置",
-            "🔧 其他配置"
-        ])
-
-        with tab1:
-            st.subheader("网络配置")
-            network = config.get('network', {})
-
-            onebot_ws_url = st.text_input(
-                "OneBot WebSocket地址",
-                value=network.get('onebot_ws_url', 'ws://127.0.0.1:8081'),
-                help="OneBot服务器的WebSocket地址"
-            )
-
-            reconnect_interval = st.number_input(
-                "重连间隔（秒）",
-                value=network.get('reconnect_interval', 5),
-                min_value=1,
-                max_value=60
-            )
-
-            timeout = st.number_input(
-                "超时时间（秒）",
-                value=network.get('timeout', 30),
-                min_value=5,
-                max_value=300
-            )
+        # 当前配置在本会话成功获取一次后保存，编辑控件触发的重新运行不再请求后端；
+        # 获取失败时不保存，下次重新运行时继续获取
+        if "cfg" not in st.session_state:
+            load_config_state()
+
+        if st.button("🔁 重新加载"):
+            clear_cache()
+            load_config_state()
+            st.rerun()
+
+        # 未能获取到当前配置时只显示默认值，并禁止保存（避免用默认值覆盖后端配置）
+        config_loaded = "cfg" in st.session_state
+        if config_loaded:
+            config = st.session_state.cfg
+            flat = st.session_state.cfg_flat
+        else:
+            config = {}
+            flat = CONFIG_DEFAULTS
+            st.warning("未能获取当前配置，保存已禁用。请确认API服务已启动后点击重新加载。")
+
+        # 所有配置项放在一个表单中，编辑时不触发重新运行，点击按钮时才统一提交
+        with st.form("config_form", border=False):
+            # 分组显示配置
+            tab1, tab2, tab3, tab4, tab5 = st.tabs([
+                "🌐 网络配置",
+                "🤖 Claude配置",
+                "🎯 Bot配置",
+                "📝 日志配置",
+                "🔧 其他配置"
+            ])
+
+            with tab1:
+                st.subheader("网络配置")
+
+                onebot_ws_url = st.text_input(
+                    "OneBot WebSocket地址",
+                    value=flat['network.onebot_ws_url'],
+                    help="OneBot服务器的WebSocket地址"
+                )
 
-            st.divider()
-            st.subheader("代理配置")
-            proxy = config.get('proxy', {})
-
-            proxy_enabled = st.checkbox("启用代理", value=proxy.get('enabled', False))
-            http_proxy = st.text_input(
-                "HTTP代理",
-                value=proxy.get('http_proxy', ''),
-                disabled=not proxy_enabled
-            )
-            https_proxy = st.text_input(
-                "HTTPS代理",
-                value=proxy.get('https_proxy', ''),
-                disabled=not proxy_enabled
-            )
-            no_proxy = st.text_input(
-                "不使用代理的地址",
-                value=proxy.get('no_proxy', 'localhost,127.0.0.1'),
-                disabled=not proxy_enabled
-            )
-
-        with tab2:
-            st.subheader("Claude配置")
-            claude = config.get('claude', {})
-
-            cli_path = st.text_input(
-                "Claude CLI路径",
-                value=claude.get('cli_path', 'claude'),
-                help="Claude Code CLI的完整路径或命令名"
-            )
-
-            work_dir = st.text_input(
-                "工作目录",
-                value=claude.get('work_dir', '.'),
-                help="Claude的工作目录（项目根目录）"
-            )
-
-            timeout = st.number_input(
-                "超时时间（秒）",
-                value=claude.get('timeout', 300),
-                min_value=10,
-                max_value=3600
-            )
+                reconnect_interval = st.number_input(
+                    "重连间隔（秒）",
+                    value=flat['network.reconnect_interval'],
+                    min_value=1,
+                    max_value=60
+                )
 
-            st.divider()
-            st.subheader("错误重试配置")
-
-            max_retries = st.number_input(
-                "最大重试次数",
-                value=claude.get('max_retries', 3),
-                min_value=0,
-                max_value=10,
-                help="调用失败时的重试次数"
-            )
-
-            initial_backoff = st.number_input(
-                "初始退避时间（秒）",
-                value=claude.get('initial_backoff', 1.0),
-                min_value=0.1,
-                max_value=10.0,
-                step=0.1,
-                help="首次重试前的等待时间"
-            )
-
-            max_backoff = st.number_input(
-                "最大退避时间（秒）",
-                value=claude.get('max_backoff', 60.0),
-                min_value=1.0,
-                max_value=300.0,
-                step=1.0,
-                help="重试等待时间的最大值"
-            )
-
-        with tab3:
-            st.subheader("Bot配置")
-            bot = config.get('bot', {})
-
-            qq_number = st.text_input(
-                "Bot QQ号",
-                value=bot.get('qq_number', ''),
-                help="用于识别@消息"
-            )
-
-            auto_reply_private = st.checkbox(
-                "私聊自动回复",
-                value=bot.get('auto_reply_private', True)
-            )
-
-            ignore_temp_session = st.checkbox(
-                "忽略临时会话",
-                value=bot.get('ignore_temp_session', True)
-            )
-
-            command_prefix_str = st.text_input(
-                "命令前缀（逗号分隔）",
-                value=', '.join(bot.get('command_prefix', ['/c', '/claude', '/问', '/ask']))
-            )
+                network_timeout = st.number_input(
+                    "超时时间（秒）",
+                    value=flat['network.timeout'],
+                    min_value=5,
+                    max_value=300
+                )
 
-            st.divider()
-            st.subheader("心跳检测配置")
-
-            heartbeat_enabled = st.checkbox(
-                "启用心跳检测",
-                value=bot.get('heartbeat_enabled', True),
-                help="定期检测NapCat连接状态"
-            )
-
-            heartbeat_interval = st.number_input(
-                "心跳间隔（秒）",
-                value=bot.get('heartbeat_interval', 60),
-                min_value=10,
-                max_value=600,
-                disabled=not heartbeat_enabled,
-                help="心跳检测的时间间隔"
-            )
-
-            max_connection_failures = st.number_input(
-                "连续失败阈值",
-                value=bot.get('max_connection_failures', 3),
-                min_value=1,
-                max_value=10,
-                disabled=not heartbeat_enabled,
-                help="连续失败多少次判定为掉线"
-            )
-
-        with tab4:
-            st.subheader("日志配置")
-            logging_config = config.get('logging', {})
-
-            level = st.selectbox(
-                "日志级别",
-                ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
-                index=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"].index(
-                    logging_config.get('level', 'INFO')
+                st.divider()
+                st.subheader("代理配置")
+
+                proxy_enabled = st.checkbox("启用代理", value=flat['proxy.enabled'])
+                http_proxy = st.text_input(
+                    "HTTP代理",
+                    value=flat['proxy.http_proxy']
+                )
+                https_proxy = st.text_input(
+                    "HTTPS代理",
+                    value=flat['proxy.https_proxy']
+                )
+                no_proxy = st.text_input(
+                    "不使用代理的地址",
+                    value=flat['proxy.no_proxy']
+                )
+
+            with tab2:
+                st.subheader("Claude配置")
+
+                cli_path = st.text_input(
+                    "Claude CLI路径",
+                    value=flat['claude.cli_path'],
+                    help="Claude Code CLI的完整路径或命令名"
+                )
+
+                work_dir = st.text_input(
+                    "工作目录",
+                    value=flat['claude.work_dir'],
+                    help="Claude的工作目录（项目根目录）"
+                )
+
+                timeout = st.number_input(
+                    "超时时间（秒）",
+                    value=flat['claude.timeout'],
+                    min_value=10,
+                    max_value=3600
+                )
+
+                st.divider()
+                st.subheader("错误重试配置")
+
+                max_retries = st.number_input(
+                    "最大重试次数",
+                    value=flat['claude.max_retries'],
+                    min_value=0,
+                    max_value=10,
+                    help="调用失败时的重试次数"
+                )
+
+                initial_backoff = st.number_input(
+                    "初始退避时间（秒）",
+                    value=flat['claude.initial_backoff'],
+                    min_value=0.1,
+                    max_value=10.0,
+                    step=0.1,
+                    help="首次重试前的等待时间"
                 )
-            )
 
-            console = st.checkbox("输出到控制台", value=logging_config.get('console', True))
+                max_backoff = st.number_input(
+                    "最大退避时间（秒）",
+                    value=flat['claude.max_backoff'],
+                    min_value=1.0,
+                    max_value=300.0,
+                    step=1.0,
+                    help="重试等待时间的最大值"
+                )
+
+            with tab3:
+                st.subheader("Bot配置")
 
-            file_enabled = st.checkbox("输出到文件", value=logging_config.get('file', {}).get('enabled', True))
+                qq_number = st.text_input(
+                    "Bot QQ号",
+                    value=flat['bot.qq_number'],
+                    help="用于识别@消息"
+                )
+
+                auto_reply_private = st.checkbox(
+                    "私聊自动回复",
+                    value=flat['bot.auto_reply_private']
+                )
+
+                ignore_temp_session = st.checkbox(
+                    "忽略临时会话",
+                    value=flat['bot.ignore_temp_session']
+                )
+
+                command_prefix_str = st.text_input(
+                    "命令前缀（逗号分隔）",
+                    value=', '.join(flat['bot.command_prefix'])
+                )
+
+                st.divider()
+                st.subheader("心跳检测配置")
+
+                heartbeat_enabled = st.checkbox(
+                    "启用心跳检测",
+                    value=flat['bot.heartbeat_enabled'],
+                    help="定期检测NapCat连接状态"
+                )
+
+                heartbeat_interval = st.number_input(
+                    "心跳间隔（秒）",
+                    value=flat['bot.heartbeat_interval'],
+                    min_value=10,
+                    max_value=600,
+                    help="心跳检测的时间间隔"
+                )
+
+                max_connection_failures = st.number_input(
+                    "连续失败阈值",
+                    value=flat['bot.max_connection_failures'],
+                    min_value=1,
+                    max_value=10,
+                    help="连续失败多少次判定为掉线"
+                )
+
+            with tab4:
+                st.subheader("日志配置")
+
+                level = st.selectbox(
+                    "日志级别",
+                    LOG_LEVELS,
+                    index=LOG_LEVEL_INDEX.get(flat['logging.level'], LOG_LEVEL_INDEX['INFO'])
+                )
+
+                console = st.checkbox("输出到控制台", value=flat['logging.console'])
+
+                file_enabled = st.checkbox("输出到文件", value=flat['logging.file.enabled'])
+                # 以下文件选项仅在启用文件输出时保存（旧版本关闭时会写入0，这里按最小值显示）
 
-            if file_enabled:
-                file_config = logging_config.get('file', {})
                 file_path = st.text_input(
                     "日志文件路径",
-                    value=file_config.get('path', 'logs/app.log')
+                    value=flat['logging.file.path']
                 )
                 max_size = st.number_input(
                     "单文件最大大小（MB）",
-                    value=file_config.get('max_size', 10485760) // 1048576,
+                    value=max(flat['logging.file.max_size'] // MB, 1),
                     min_value=1,
                     max_value=100
                 )
                 backup_count = st.number_input(
                     "备份文件数量",
-                    value=file_config.get('backup_count', 5),
+                    value=max(flat['logging.file.backup_count'], 1),
                     min_value=1,
                     max_value=20
                 )
 
-        with tab5:
-            st.subheader("API配置")
-            api = config.get('api', {})
-
-            api_enabled = st.checkbox("启用API", value=api.get('enabled', True))
-            api_host = st.text_input(
-                "API监听地址",
-                value=api.get('host', '127.0.0.1'),
-                disabled=not api_enabled
-            )
-            api_port = st.number_input(
-                "API端口",
-                value=api.get('port', 8000),
-                min_value=1024,
-                max_value=65535,
-                disabled=not api_enabled
-            )
+            with tab5:
+                st.subheader("API配置")
+
+                api_enabled = st.checkbox("启用API", value=flat['api.enabled'])
+                api_host = st.text_input(
+                    "API监听地址",
+                    value=flat['api.host']
+                )
+                api_port = st.number_input(
+                    "API端口",
+                    value=flat['api.port'],
+                    min_value=1024,
+                    max_value=65535
+                )
+
+                st.divider()
+                st.subheader("WebUI配置")
 
+                webui_enabled = st.checkbox("启用WebUI", value=flat['webui.enabled'])
+                webui_host = st.text_input(
+                    "WebUI监听地址",
+                    value=flat['webui.host']
+                )
+                webui_port = st.number_input(
+                    "WebUI端口",
+                    value=flat['webui.port'],
+                    min_value=1024,
+                    max_value=65535
+                )
+
+            # 保存按钮
             st.divider()
-            st.subheader("WebUI配置")
-            webui = config.get('webui', {})
-
-            webui_enabled = st.checkbox("启用WebUI", value=webui.get('enabled', True))
-            webui_host = st.text_input(
-                "WebUI监听地址",
-                value=webui.get('host', '127.0.0.1'),
-                disabled=not webui_enabled
-            )
-            webui_port = st.number_input(
-                "WebUI端口",
-                value=webui.get('port', 8501),
-                min_value=1024,
-                max_value=65535,
-                disabled=not webui_enabled
-            )
-
-        # 保存按钮
-        st.divider()
-        col1, col2 = st.columns([1, 1])
+            col1, col2 = st.columns([1, 1])
 
-        with col1:
-            if st.button("💾 保存配置", use_container_width=True, type="primary"):
-                # 构建配置数据
-                config_data = {
-                    "network": {
+            with col1:
+                if st.form_submit_button("💾 保存配置", use_container_width=True, type="primary",
+                                         disabled=not config_loaded):
+                    # 命令前缀：未修改默认值时直接使用常量，否则拆分并去掉空项
+                    if command_prefix_str == DEFAULT_PREFIX_STR:
+                        command_prefix = list(DEFAULT_PREFIXES)
+                    else:
+                        command_prefix = [p for p in (x.strip() for x in command_prefix_str.split(',')) if p]
+
+                    # 在当前配置上原地更新表单中的各项（表单中没有的项保持不变）
+                    config_data = config
+                    config_data.setdefault('network', {}).update({
                         "onebot_ws_url": onebot_ws_url,
                         "reconnect_interval": reconnect_interval,
-                        "timeout": timeout
-                    },
-                    "proxy": {
+                        "timeout": network_timeout
+                    })
+                    config_data.setdefault('proxy', {}).update({
                         "enabled": proxy_enabled,
                         "http_proxy": http_proxy,
                         "https_proxy": https_proxy,
                         "no_proxy": no_proxy
-                    },
-                    "claude": {
+                    })
+                    config_data.setdefault('claude', {}).update({
                         "cli_path": cli_path,
                         "work_dir": work_dir,
                         "timeout": timeout,
                         "max_retries": max_retries,
                         "initial_backoff": initial_backoff,
                         "max_backoff": max_backoff
-                    },
-                    "bot": {
+                    })
+                    config_data.setdefault('bot', {}).update({
                         "qq_number": qq_number,
                         "auto_reply_private": auto_reply_private,
                         "ignore_temp_session": ignore_temp_session,
-                        "command_prefix": [p.strip() for p in command_prefix_str.split(',')],
+                        "command_prefix": command_prefix,
                         "heartbeat_enabled": heartbeat_enabled,
                         "heartbeat_interval": heartbeat_interval,
                         "max_connection_failures": max_connection_failures
-                    },
-                    "logging": {
-                        "level": level,
-                        "console": console,
-                        "file": {
-                            "enabled": file_enabled,
-                            "path": file_path if file_enabled else '',
-                            "max_size": max_size * 1048576 if file_enabled else 0,
-                            "backup_count": backup_count if file_enabled else 0
-                        }
-                    },
-                    "api": {
+                    })
+                    logging_data = config_data.setdefault('logging', {})
+                    logging_data.update({"level": level, "console": console})
+                    file_data = logging_data.setdefault('file', {})
+                    file_data["enabled"] = file_enabled
+                    if file_enabled:
+                        file_data.update({
+                            "path": file_path,
+                            "max_size": max_size * MB,
+                            "backup_count": backup_count
+                        })
+                    config_data.setdefault('api', {}).update({
                         "enabled": api_enabled,
                         "host": api_host,
                         "port": api_port
-                    },
-                    "webui": {
+                    })
+                    config_data.setdefault('webui', {}).update({
                         "enabled": webui_enabled,
                         "host": webui_host,
                         "port": webui_port
-                    }
-                }
+                    })
 
-                result = update_config(config_data)
-                if result.get('status') == 'success':
-                    st.success("配置已保存！重启Bot以应用新配置。")
-                else:
-                    st.error(f"保存失败: {result.get('message')}")
+                    # 只提交相对加载时有变化的项
+                    patch = diff_config(st.session_state.cfg_original, config_data)
+                    if not patch:
+                        st.info("配置未变化")
+                    else:
+                        result = update_config(config_data, patch)
+                        if result.get('status') == 'success':
+                            set_config_state(config_data)
+                            st.success("配置已保存！重启Bot以应用新配置。")
+                        else:
+                            st.error(f"保存失败: {result.get('message')}")
 
-        with col2:
-            if st.button("🔄 重置为默认", use_container_width=True):
-                st.warning("重置功能暂未实现")
+            with col2:
+                if st.form_submit_button("🔄 重置为默认", use_container_width=True):
+                    st.warning("重置功能暂未实现")
 
     elif page == "📊 系统状态":
         st.header("系统状态")
 
-        # 详细状态
-        detailed_status = get_detailed_status()
+        # 详细状态、API服务信息和配置一次取回
+        dashboard = fetch_dashboard()
+        detailed_status = dashboard.get('status', {})
 
         # Bot状态
         col1, col2 = st.columns(2)
@@ -562,10 +809,10 @@ def main():
                 else:
                     st.error("❌ OneBot 未连接")
 
+                # 心跳时间和timestamp都是后端的单调时钟读数，只能相减比较
                 last_heartbeat = onebot.get('last_heartbeat')
                 if last_heartbeat:
-                    import time as time_module
-                    elapsed = time_module.time() - last_heartbeat
+                    elapsed = detailed_status.get('timestamp', last_heartbeat) - last_heartbeat
                     if elapsed < 60:
                         st.success(f"✅ 心跳正常（{elapsed:.1f}秒前）")
                     else:
@@ -598,21 +845,18 @@ def main():
 
         # API状态
         st.subheader("🌐 API状态")
-        try:
-            response = requests.get(f"{API_URL}/")
-            if response.status_code == 200:
-                st.success("✅ API 服务正常")
-                st.json(response.json())
-            else:
-                st.error(f"❌ API 服务异常: {response.status_code}")
-        except Exception as e:
-            st.error(f"❌ API 连接失败: {e}")
+        if dashboard.get('root'):
+            st.success("✅ API 服务正常")
+            st.json(dashboard['root'])
+        else:
+            st.error(f"❌ API 连接失败: {dashboard.get('error')}")
 
         st.divider()
 
         # 当前配置
         st.subheader("📝 当前配置")
-        st.json(get_config())
+        # 默认折叠到第一层，浏览器只需渲染各节标题，展开时再渲染具体配置项
+        st.json(dashboard.get('config', {}), expanded=1)
 
 
 if __name__ == "__main__":